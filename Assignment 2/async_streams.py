@@ -0,0 +1,242 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# bytes of one keystream job, a large write is split so its pieces are computed side by side
+CHUNK_SIZE = 1 << 16
+
+
+class StreamCrypt:
+    """One direction of a connection through a stream cipher, the keystream work runs in an executor.
+
+    Ciphers with crypt_range(data, offset) (CTRMode, Salsa) are random access: every chunk knows its message
+    offset when it is submitted, so the chunks of one or many connections are computed concurrently, on the
+    same cipher object when the executor is a thread pool (AES, Kalyna and Salsa keep no shared scratch state).
+    Stateful ciphers (RC4) go through method (encrypt / decrypt) one chunk after the other, their state lives
+    in the object, so they need a thread executor (None, the default executor of the loop).
+    """
+
+    def __init__(self, cipher, method="encrypt", executor=None, offset=0):
+        self._cipher = cipher
+        self._method = method
+        self._executor = executor
+        self._offset = offset
+
+        self._random_access = hasattr(cipher, "crypt_range")
+        assert self._random_access or not isinstance(executor, ProcessPoolExecutor)
+        self._last = None
+
+    def submit(self, data):
+        """Future of the encrypted / decrypted data (a uint8 ndarray), results come in the order of submission"""
+        loop = asyncio.get_running_loop()
+
+        if self._random_access:
+            future = loop.run_in_executor(self._executor, self._cipher.crypt_range, data, self._offset)
+            self._offset += len(data)
+            return future
+
+        self._last = asyncio.ensure_future(self._chained(loop, self._last, data))
+        return self._last
+
+    async def _chained(self, loop, previous, data):
+        if previous is not None:
+            await asyncio.shield(previous)
+        return await loop.run_in_executor(self._executor, getattr(self._cipher, self._method), data)
+
+
+class EncryptedStreamWriter:
+    """asyncio.StreamWriter that encrypts what is written. write() only submits the keystream jobs and returns,
+    drain() sends the finished chunks in order and waits for the transport like StreamWriter.drain.
+    """
+
+    def __init__(self, writer, cipher, executor=None, offset=0, chunk_size=CHUNK_SIZE):
+        self._writer = writer
+        self._crypt = StreamCrypt(cipher, "encrypt", executor, offset)
+        self._chunk_size = chunk_size
+        self._pending = deque()
+
+    @property
+    def transport(self):
+        return self._writer.transport
+
+    def get_extra_info(self, name, default=None):
+        return self._writer.get_extra_info(name, default)
+
+    def write(self, data):
+        # the caller may reuse a mutable buffer once write returns
+        data = memoryview(data if isinstance(data, bytes) else bytes(data))
+        for start in range(0, len(data), self._chunk_size):
+            self._pending.append(self._crypt.submit(data[start: start + self._chunk_size]))
+
+    def writelines(self, data):
+        for line in data:
+            self.write(line)
+
+    async def drain(self):
+        while self._pending:
+            self._writer.write(memoryview(await self._pending.popleft()))
+        await self._writer.drain()
+
+    def can_write_eof(self):
+        return self._writer.can_write_eof()
+
+    async def write_eof(self):
+        """A coroutine unlike StreamWriter.write_eof, the pending chunks are sent first"""
+        await self.drain()
+        self._writer.write_eof()
+
+    def is_closing(self):
+        return self._writer.is_closing()
+
+    async def aclose(self):
+        """Send what is still pending, then close the underlying writer"""
+        await self.drain()
+        self.close()
+        await self.wait_closed()
+
+    def close(self):
+        # chunks that were written but not drained are dropped, like the buffer of a closed transport
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._writer.close()
+
+    async def wait_closed(self):
+        await self._writer.wait_closed()
+
+
+class EncryptedStreamReader:
+    """asyncio.StreamReader that decrypts what is read, every read hands the received bytes to the executor"""
+
+    def __init__(self, reader, cipher, executor=None, offset=0):
+        self._reader = reader
+        self._crypt = StreamCrypt(cipher, "decrypt", executor, offset)
+
+    async def _decrypt(self, data):
+        if not data:
+            return data
+        return (await self._crypt.submit(data)).tobytes()
+
+    async def read(self, n=-1):
+        return await self._decrypt(await self._reader.read(n))
+
+    async def readexactly(self, n):
+        return await self._decrypt(await self._reader.readexactly(n))
+
+    def at_eof(self):
+        return self._reader.at_eof()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.read(CHUNK_SIZE)
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+
+def wrap_streams(reader, writer, read_cipher, write_cipher, executor=None):
+    """Wrap the two directions of a connection: read_cipher decrypts what arrives, write_cipher encrypts what is
+    sent. Random access ciphers start at offset 0 on both sides, the peer uses the same ciphers the other way round.
+    """
+    return EncryptedStreamReader(reader, read_cipher, executor), EncryptedStreamWriter(writer, write_cipher, executor)
+
+
+async def open_connection(host, port, read_cipher, write_cipher, executor=None, **kwargs):
+    reader, writer = await asyncio.open_connection(host, port, **kwargs)
+    return wrap_streams(reader, writer, read_cipher, write_cipher, executor)
+
+
+async def start_server(client_connected_cb, host, port, make_ciphers, executor=None, **kwargs):
+    """asyncio.start_server whose callback gets wrapped streams, make_ciphers() returns the
+    (read_cipher, write_cipher) pair of a new connection
+    """
+    async def connected(reader, writer):
+        await client_connected_cb(*wrap_streams(reader, writer, *make_ciphers(), executor))
+
+    return await asyncio.start_server(connected, host, port, **kwargs)
+
+
+if __name__ == '__main__':
+    import copy
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+
+    from ciphers.aes.cipher import AES, AES_TYPE
+    from ciphers.kalyna.cipher import Kalyna, KALYNA_TYPE, KALYNA_ENGINE
+    from modes.ctr import CTRMode
+    from rc4 import RC4
+    from salsa20 import Salsa
+
+    np.random.seed(0)
+    key = [w_i for w_i in bytearray.fromhex("000102030405060708090a0b0c0d0e0f")]
+    MESSAGE = np.random.randint(256, size=(1 << 20) + 3, dtype=np.uint8).tobytes()
+    kalyna_key = np.arange(32, dtype=np.uint8).view(np.uint64)
+
+    async def echo(reader, writer):
+        # the server stands in for the network: it returns the bytes it got, still encrypted
+        while data := await reader.read(CHUNK_SIZE):
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    async def round_trip(port, cipher, message, executor):
+        # the client encrypts what it sends and decrypts the echo with a copy of the same cipher
+        reader, writer = await open_connection("127.0.0.1", port, copy.deepcopy(cipher), cipher, executor)
+
+        async def send():
+            for start in range(0, len(message), 10000):
+                writer.write(message[start: start + 10000])
+            await writer.write_eof()
+
+        async def receive():
+            return b"".join([chunk async for chunk in reader])
+
+        _, received = await asyncio.gather(send(), receive())
+        writer.close()
+        return received
+
+    async def main():
+        server = await asyncio.start_server(echo, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        with ThreadPoolExecutor(4) as executor:
+            for name, make_cipher, size in (("RC4", lambda: RC4(key), 1 << 12),
+                                            ("Salsa20", lambda: Salsa(np.arange(32, dtype=np.uint8)), len(MESSAGE)),
+                                            ("AES-128 CTR", lambda: CTRMode(AES(key, AES_TYPE.AES_128)), len(MESSAGE)),
+                                            ("Kalyna-256 CTR", lambda: CTRMode(Kalyna(kalyna_key, KALYNA_TYPE.KALYNA_256_256,
+                                                                                      KALYNA_ENGINE.T_TABLE)), len(MESSAGE))):
+                t1 = datetime.now()
+                # several connections pipelined through the same executor
+                results = await asyncio.gather(*[round_trip(port, make_cipher(), MESSAGE[:size], executor) for _ in range(4)])
+                t2 = datetime.now()
+                print(name, all(result == MESSAGE[:size] for result in results), t2 - t1)
+
+        server.close()
+        await server.wait_closed()
+
+        # both ends encrypted: the server decrypts, upper-cases and encrypts the reply with its own RC4 pair
+        server_key, client_key = list(range(16)), list(range(16, 32))
+
+        async def upper(reader, writer):
+            async for data in reader:
+                writer.write(data.upper())
+                await writer.drain()
+            await writer.aclose()
+
+        server = await start_server(upper, "127.0.0.1", 0, lambda: (RC4(client_key), RC4(server_key)))
+        reader, writer = await open_connection("127.0.0.1", server.sockets[0].getsockname()[1],
+                                               RC4(server_key), RC4(client_key))
+        writer.write(b"plaintext over an encrypted socket")
+        await writer.write_eof()
+        # the reply ends when the server has seen the end of the request and closed its side
+        print(b"".join([chunk async for chunk in reader]))
+        writer.close()
+
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+"""Throughput and latency of every cipher x mode x key size x direction x message size.
+
+    python benchmark.py run [-o results.json] [--sizes 64 1K 16M] [--filter AES-128/CTR/decrypt] [--repeat 5]
+    python benchmark.py compare baseline.json results.json [--threshold 0.1]
+
+run writes one record per case (median / min / mean latency of a call and the MB/s of the median) and rewrites
+the output after every record, so an interrupted run keeps what it measured. compare matches the cases of two
+result files and exits with 1 when one of them lost more than threshold of its throughput.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from ciphers.aes.cipher import AES, AES_TYPE, AES_ENGINE
+from ciphers.kalyna.cipher import Kalyna, KALYNA_TYPE, KALYNA_ENGINE
+from modes.cbc import CBCMode
+from modes.cfb import CFBMode
+from modes.ctr import CTRMode
+from modes.ecb import ECBMode
+from modes.gcm import GCMMode
+from modes.ofb import OFBMode
+from modes.xts import XTSMode
+from rc4 import RC4
+from salsa20 import Salsa
+
+# 64 B to 64 MB
+SIZES = tuple(64 << shift for shift in range(0, 21, 4))
+REPEAT = 5
+WARMUP = 1
+# a repetition calls the cipher until it has run this long, so short messages are not timed one call at a time
+MIN_TIME = 0.05
+# larger messages of a case are skipped once one call takes longer than this
+MAX_CALL_TIME = 5.0
+# relative throughput loss reported as a regression by compare
+THRESHOLD = 0.1
+# decrypt runs the inverse cipher (ECB, CBC, XTS), the batched CBC / CFB decryption and the GCM tag check
+DIRECTIONS = ("encrypt", "decrypt")
+
+AES_KEYS = {128: AES_TYPE.AES_128, 192: AES_TYPE.AES_192, 256: AES_TYPE.AES_256}
+# (block bits, key bits)
+KALYNA_KEYS = {(128, 128): KALYNA_TYPE.KALYNA_128_128, (128, 256): KALYNA_TYPE.KALYNA_128_256,
+               (256, 256): KALYNA_TYPE.KALYNA_256_256, (256, 512): KALYNA_TYPE.KALYNA_256_512,
+               (512, 512): KALYNA_TYPE.KALYNA_512_512}
+
+BLOCK_MODES = {"ECB": ECBMode, "CBC": CBCMode, "CFB": CFBMode, "OFB": OFBMode, "CTR": CTRMode}
+# modes defined for 128-bit blocks only
+WIDE_MODES = {"GCM": lambda cipher, size: GCMMode(cipher),
+              "XTS": lambda cipher, size: XTSMode(cipher, cipher, sector_size=min(size, XTSMode.SECTOR_SIZE))}
+
+
+def crypt_function(mode, direction, data):
+    """(function, argument) of one timed call: encrypt(data), GCM gets a fresh IV per call like a real sender,
+    or decrypt of the ciphertext of data, encrypted once beforehand (GCM verifies the tag of every call)
+    """
+    if isinstance(mode, GCMMode):
+        if direction == "encrypt":
+            return lambda plaintext: mode.encrypt(GCMMode.new_iv(), plaintext), data
+        iv = GCMMode.new_iv()
+        return lambda ciphertext: mode.decrypt(iv, ciphertext), mode.encrypt(iv, data)
+
+    if direction == "encrypt":
+        return mode.encrypt, data
+    return mode.decrypt, mode.encrypt(data)
+
+
+def parse_size(text):
+    """64, 16K, 4M -> bytes"""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.upper().rstrip("B")
+    return int(text[:-1]) * units[text[-1]] if text[-1] in units else int(text)
+
+
+def format_size(size):
+    for unit, shift in (("M", 20), ("K", 10)):
+        if size >= 1 << shift and size % (1 << shift) == 0:
+            return "%d%s" % (size >> shift, unit)
+    return str(size)
+
+
+def cases(engine):
+    """(name, cipher, key bits, mode, make(size) -> object with encrypt / decrypt) of every combination"""
+    for bits, aes_type in AES_KEYS.items():
+        cipher = AES(list(range(bits // 8)), aes_type, engine["AES"])
+        for mode, mode_class in BLOCK_MODES.items():
+            yield "AES-%d/%s" % (bits, mode), "AES", bits, mode, lambda size, m=mode_class, c=cipher: m(c)
+        for mode, make_mode in WIDE_MODES.items():
+            yield "AES-%d/%s" % (bits, mode), "AES", bits, mode, lambda size, m=make_mode, c=cipher: m(c, size)
+
+    for (block_bits, bits), kalyna_type in KALYNA_KEYS.items():
+        key = np.arange(bits // 8, dtype=np.uint8).view(np.uint64)
+        cipher = Kalyna(key, kalyna_type, engine["Kalyna"])
+        name = "Kalyna-%d-%d" % (block_bits, bits)
+
+        modes = dict(BLOCK_MODES, **(WIDE_MODES if block_bits == 128 else {}))
+        for mode, mode_class in modes.items():
+            make = (lambda size, m=mode_class, c=cipher: m(c, size)) if mode in WIDE_MODES else \
+                (lambda size, m=mode_class, c=cipher: m(c))
+            yield "%s/%s" % (name, mode), name, bits, mode, make
+
+    yield "RC4-128/stream", "RC4", 128, "stream", lambda size: RC4(list(range(16)))
+    yield "Salsa20-256/stream", "Salsa20", 256, "stream", lambda size: Salsa(np.arange(32, dtype=np.uint8))
+
+
+def measure(encrypt, data, repeat, warmup):
+    """Per-call latencies of encrypt(data), one per repetition"""
+    t1 = time.perf_counter()
+    for _ in range(max(warmup, 1)):
+        encrypt(data)
+    first = (time.perf_counter() - t1) / max(warmup, 1)
+
+    number = max(1, int(MIN_TIME / max(first, 1e-9)))
+    latencies = []
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        for _ in range(number):
+            encrypt(data)
+        latencies.append((time.perf_counter() - t1) / number)
+
+    return first, number, latencies
+
+
+def run(args):
+    engine = {"AES": args.aes_engine, "Kalyna": args.kalyna_engine}
+    sizes = sorted(parse_size(size) for size in args.sizes) if args.sizes else SIZES
+
+    np.random.seed(0)
+    message = np.random.randint(256, size=max(sizes), dtype=np.uint8)
+
+    report = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                 "numpy": np.__version__, "machine": platform.machine(), "platform": platform.platform(),
+                 "engine": engine, "repeat": args.repeat, "warmup": args.warmup, "complete": False},
+        "results": [],
+    }
+
+    try:
+        for case, cipher, bits, mode, make in cases(engine):
+            for direction in args.directions:
+                name = "%s/%s" % (case, direction)
+                if args.filter and not any(pattern in name for pattern in args.filter):
+                    continue
+
+                too_slow = False
+                for size in sizes:
+                    record = {"name": "%s/%s" % (name, format_size(size)), "case": name, "cipher": cipher,
+                              "key_bits": bits, "mode": mode, "direction": direction, "size": size}
+
+                    if too_slow:
+                        record["skipped"] = "a smaller message took longer than %g s" % args.max_call_time
+                    else:
+                        function, data = crypt_function(make(size), direction, message[:size])
+                        first, number, latencies = measure(function, data, args.repeat, args.warmup)
+                        median = statistics.median(latencies)
+                        record.update(repeat=args.repeat, calls=number, latency_median=median,
+                                      latency_min=min(latencies), latency_mean=statistics.mean(latencies),
+                                      mb_per_s=size / median / 1e6)
+                        too_slow = first > args.max_call_time
+
+                        print("%-40s %10.3f MB/s %12.1f us" % (record["name"], record["mb_per_s"], median * 1e6),
+                              flush=True)
+
+                    report["results"].append(record)
+                    save(report, args.output)
+    except KeyboardInterrupt:
+        print("interrupted, %d record(s) in %s" % (len(report["results"]), args.output))
+        return 130
+
+    report["meta"]["complete"] = True
+    save(report, args.output)
+    return 0
+
+
+def save(report, path):
+    """Write the report through a temporary file, an interrupt while writing leaves the previous version"""
+    with open(path + ".tmp", "w") as file:
+        json.dump(report, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def compare(args):
+    with open(args.baseline) as file:
+        baseline = {record["name"]: record for record in json.load(file)["results"] if "mb_per_s" in record}
+    with open(args.results) as file:
+        results = {record["name"]: record for record in json.load(file)["results"] if "mb_per_s" in record}
+
+    regressions = 0
+    for name in [name for name in baseline if name in results]:
+        ratio = results[name]["mb_per_s"] / baseline[name]["mb_per_s"]
+        regression = ratio < 1 - args.threshold
+        regressions += regression
+
+        if regression or not args.only_regressions:
+            print("%-40s %10.3f -> %10.3f MB/s %+7.1f%%%s" % (name, baseline[name]["mb_per_s"],
+                                                            results[name]["mb_per_s"], 100 * (ratio - 1),
+                                                            "  REGRESSION" if regression else ""))
+
+    missing = [name for name in baseline if name not in results]
+    if missing:
+        print("not in %s: %s" % (args.results, ", ".join(missing)))
+    print("%d regression(s) beyond %g%%" % (regressions, 100 * args.threshold))
+
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark every case and write the results as JSON")
+    run_parser.add_argument("-o", "--output", default="benchmark.json")
+    run_parser.add_argument("--sizes", nargs="+", help="message sizes, e.g. 64 16K 4M (default 64 B to 64 MB)")
+    run_parser.add_argument("--filter", nargs="+", help="only the cases whose name contains one of these")
+    run_parser.add_argument("--directions", nargs="+", choices=DIRECTIONS, default=DIRECTIONS)
+    run_parser.add_argument("--repeat", type=int, default=REPEAT)
+    run_parser.add_argument("--warmup", type=int, default=WARMUP)
+    run_parser.add_argument("--max-call-time", type=float, default=MAX_CALL_TIME)
+    run_parser.add_argument("--aes-engine", default=AES_ENGINE.T_TABLE)
+    run_parser.add_argument("--kalyna-engine", default=KALYNA_ENGINE.T_TABLE)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files, exit 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    compare_parser.add_argument("--only-regressions", action="store_true")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
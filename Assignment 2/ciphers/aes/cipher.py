@@ -1,6 +1,13 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
 from aes import S_BOX, INV_S_BOX
-from aes.key_expansion import key_expansion
-from tools import array2state, state2array, xtime, to_bytes
+from aes.key_expansion import key_expansion, key_expansion_blocks, S_BOX_ARRAY
+from aes.t_tables import T0, T1, T2, T3, TD0, TD1, TD2, TD3, MUL_9, MUL_11, MUL_13, MUL_14, inv_mix_column_word
+from aes.unrolled import unrolled_cipher
+from tools import array2state, state2array, buffer2blocks, xtime, to_bytes
 
 
 class AES_TYPE:
@@ -22,16 +29,101 @@ class AES_TYPE:
     }
 
 
+INV_S_BOX_ARRAY = np.array(INV_S_BOX, dtype=np.uint8)
+XTIME_ARRAY = np.array([xtime(a) for a in range(256)], dtype=np.uint8)
+MUL_4_ARRAY = XTIME_ARRAY[XTIME_ARRAY]
+
+# byte 4 * column + row of a block, row r is rotated left by r columns
+SHIFT_ROWS_INDEX = np.array([4 * ((col + row) % 4) + row for col in range(4) for row in range(4)])
+INV_SHIFT_ROWS_INDEX = np.array([4 * ((col - row) % 4) + row for col in range(4) for row in range(4)])
+ROTATE_COLUMN_INDEX = np.array([1, 2, 3, 0])
+SWAP_COLUMN_INDEX = np.array([2, 3, 0, 1])
+
+
+# number of distinct (key, AES_TYPE) schedules kept by expand_round_keys
+KEY_SCHEDULE_CACHE_SIZE = 256
+
+
+KeySchedule = namedtuple("KeySchedule", ["round_words", "dec_round_words", "enc_keys", "dec_keys",
+                                         "round_keys", "dec_round_keys"])
+
+
+@lru_cache(maxsize=KEY_SCHEDULE_CACHE_SIZE)
+def expand_round_keys(key, nb, nk, nr):
+    """Run key_expansion once per (key bytes, AES_TYPE) and keep every derived form of the round keys.
+
+    The encryption round keys and the round keys of the equivalent inverse cipher are kept as per-round
+    tuples of words, as packed 32-bit words and as read-only ndarray[Nr + 1, 16].
+    """
+    words = key_expansion(list(key), nb, nk, nr)
+    enc_keys, dec_keys = AES._pack_round_keys(words, nb, nr)
+
+    round_words = tuple(tuple(tuple(word) for word in words[round * nb: (round + 1) * nb])
+                        for round in range(nr + 1))
+    dec_round_words = tuple(tuple(tuple(word.to_bytes(4, "big")) for word in dec_keys[round * nb: (round + 1) * nb])
+                            for round in range(nr + 1))
+
+    round_keys = np.array(round_words, dtype=np.uint8).reshape(nr + 1, 4 * nb)
+    dec_round_keys = np.array(dec_round_words, dtype=np.uint8).reshape(nr + 1, 4 * nb)
+    round_keys.setflags(write=False)
+    dec_round_keys.setflags(write=False)
+
+    return KeySchedule(round_words, dec_round_words, enc_keys, dec_keys, round_keys, dec_round_keys)
+
+
+class AES_ENGINE:
+    # separate SubBytes, ShiftRows, MixColumns and AddRoundKey passes over a list state
+    BASIC = "basic"
+    # SubBytes, ShiftRows and MixColumns merged into 32-bit lookup tables, state is four ints
+    T_TABLE = "t_table"
+    # T_TABLE generated as straight-line code per key size, no round loop
+    UNROLLED = "unrolled"
+    # table-free bitsliced circuit for batches of at least BitslicedAES.MIN_BLOCKS blocks
+    BITSLICED = "bitsliced"
+
+
 class AES:
+    # blocks passed to encrypt_blocks / decrypt_blocks per call by the buffer API
+    BUFFER_CHUNK_BLOCKS = 1 << 16
+    # a block is a list / ndarray of block_size bytes
+    block_dtype = np.uint8
 
-    def __init__(self, key, cipher_type=AES_TYPE.AES_128):
+    def __init__(self, key, cipher_type=AES_TYPE.AES_128, engine=AES_ENGINE.BASIC):
         self._key = key
 
         self._nk = cipher_type["Nk"]
         self._nb = cipher_type["Nb"]
         self._nr = cipher_type["Nr"]
+        self._engine = engine
+
+        schedule = expand_round_keys(bytes(key), self._nb, self._nk, self._nr)
+        self._round_words = schedule.round_words
+        self._dec_round_words = schedule.dec_round_words
+        self._enc_keys = schedule.enc_keys
+        self._dec_keys = schedule.dec_keys
+        self._round_keys = schedule.round_keys
+        self._dec_round_keys = schedule.dec_round_keys
 
-        self._words = key_expansion(key, self._nb, self._nk, self._nr)
+        if engine == AES_ENGINE.BITSLICED:
+            self._bitsliced = BitslicedAES(key, cipher_type)
+
+    @property
+    def block_size(self):
+        return 4 * self._nb
+
+    @staticmethod
+    def _pack_round_keys(words, nb, nr):
+        enc_keys = [int.from_bytes(bytes(word), "big") for word in words]
+
+        # equivalent inverse cipher: reversed round order, InvMixColumns applied to inner round keys
+        dec_keys = []
+        for round in range(nr, -1, -1):
+            round_key = enc_keys[round * nb: (round + 1) * nb]
+            if 0 < round < nr:
+                round_key = [inv_mix_column_word(word) for word in round_key]
+            dec_keys.extend(round_key)
+
+        return tuple(enc_keys), tuple(dec_keys)
 
     @staticmethod
     def _sub_bytes(state):
@@ -76,14 +168,11 @@ class AES:
     @staticmethod
     def _inv_mix_columns(state):
         for word in state:
-            u = xtime(xtime(word[0] ^ word[2]))
-            v = xtime(xtime(word[1] ^ word[3]))
-            word[0] ^= u
-            word[1] ^= v
-            word[2] ^= u
-            word[3] ^= v
-
-        AES._mix_columns(state)
+            a0, a1, a2, a3 = word
+            word[0] = MUL_14[a0] ^ MUL_11[a1] ^ MUL_13[a2] ^ MUL_9[a3]
+            word[1] = MUL_9[a0] ^ MUL_14[a1] ^ MUL_11[a2] ^ MUL_13[a3]
+            word[2] = MUL_13[a0] ^ MUL_9[a1] ^ MUL_14[a2] ^ MUL_11[a3]
+            word[3] = MUL_11[a0] ^ MUL_13[a1] ^ MUL_9[a2] ^ MUL_14[a3]
 
     @staticmethod
     def _add_round_key(state, key):
@@ -91,42 +180,405 @@ class AES:
             for j in range(4):
                 word[j] ^= key_word[j]
 
+    @staticmethod
+    def _mix_columns_blocks(state):
+        columns = state.reshape(-1, 4, 4)
+        t = np.bitwise_xor.reduce(columns, axis=2)
+        columns = columns ^ t[:, :, np.newaxis] ^ XTIME_ARRAY[columns ^ columns[:, :, ROTATE_COLUMN_INDEX]]
+        return columns.reshape(-1, 16)
+
+    @staticmethod
+    def _inv_mix_columns_blocks(state):
+        columns = state.reshape(-1, 4, 4)
+        columns = columns ^ MUL_4_ARRAY[columns ^ columns[:, :, SWAP_COLUMN_INDEX]]
+        return AES._mix_columns_blocks(columns)
+
+    def encrypt_blocks(self, blocks):
+        """Encrypt an ndarray[N, 16] of uint8 blocks, every round is applied to all N blocks at once"""
+        blocks = np.asarray(blocks, dtype=np.uint8).reshape(-1, 16)
+        if self._engine == AES_ENGINE.BITSLICED and len(blocks) >= BitslicedAES.MIN_BLOCKS:
+            return self._bitsliced.encrypt_blocks(blocks)
+
+        keys = self._round_keys
+        state = blocks ^ keys[0]
+
+        for round in range(1, self._nr):
+            state = self._mix_columns_blocks(S_BOX_ARRAY[state[:, SHIFT_ROWS_INDEX]]) ^ keys[round]
+
+        return S_BOX_ARRAY[state[:, SHIFT_ROWS_INDEX]] ^ keys[self._nr]
+
+    def decrypt_blocks(self, blocks):
+        """Decrypt an ndarray[N, 16] of uint8 blocks, every round is applied to all N blocks at once"""
+        blocks = np.asarray(blocks, dtype=np.uint8).reshape(-1, 16)
+        if self._engine == AES_ENGINE.BITSLICED and len(blocks) >= BitslicedAES.MIN_BLOCKS:
+            return self._bitsliced.decrypt_blocks(blocks)
+
+        keys = self._dec_round_keys
+        state = blocks ^ keys[0]
+
+        for round in range(1, self._nr):
+            state = self._inv_mix_columns_blocks(INV_S_BOX_ARRAY[state[:, INV_SHIFT_ROWS_INDEX]]) ^ keys[round]
+
+        return INV_S_BOX_ARRAY[state[:, INV_SHIFT_ROWS_INDEX]] ^ keys[self._nr]
+
+    def _process_into(self, process_blocks, src, dst):
+        source = buffer2blocks(src, 4 * self._nb)
+        target = buffer2blocks(dst, 4 * self._nb)
+        assert source.shape == target.shape
+
+        for start in range(0, len(source), self.BUFFER_CHUNK_BLOCKS):
+            end = start + self.BUFFER_CHUNK_BLOCKS
+            target[start:end] = process_blocks(source[start:end])
+
+    def encrypt_into(self, src, dst):
+        """Encrypt the buffer src (bytes, bytearray, memoryview, mmap, ndarray) into the writable buffer dst"""
+        self._process_into(self.encrypt_blocks, src, dst)
+
+    def decrypt_into(self, src, dst):
+        """Decrypt the buffer src (bytes, bytearray, memoryview, mmap, ndarray) into the writable buffer dst"""
+        self._process_into(self.decrypt_blocks, src, dst)
+
+    def encrypt_inplace(self, buffer):
+        self._process_into(self.encrypt_blocks, buffer, buffer)
+
+    def decrypt_inplace(self, buffer):
+        self._process_into(self.decrypt_blocks, buffer, buffer)
+
+    def _t_table_encrypt(self, plaintext):
+        keys = self._enc_keys
+        block = int.from_bytes(bytes(plaintext), "big")
+
+        s0 = (block >> 96) ^ keys[0]
+        s1 = ((block >> 64) & 0xFFFFFFFF) ^ keys[1]
+        s2 = ((block >> 32) & 0xFFFFFFFF) ^ keys[2]
+        s3 = (block & 0xFFFFFFFF) ^ keys[3]
+
+        for i in range(4, 4 * self._nr, 4):
+            t0 = T0[s0 >> 24] ^ T1[(s1 >> 16) & 0xFF] ^ T2[(s2 >> 8) & 0xFF] ^ T3[s3 & 0xFF] ^ keys[i]
+            t1 = T0[s1 >> 24] ^ T1[(s2 >> 16) & 0xFF] ^ T2[(s3 >> 8) & 0xFF] ^ T3[s0 & 0xFF] ^ keys[i + 1]
+            t2 = T0[s2 >> 24] ^ T1[(s3 >> 16) & 0xFF] ^ T2[(s0 >> 8) & 0xFF] ^ T3[s1 & 0xFF] ^ keys[i + 2]
+            t3 = T0[s3 >> 24] ^ T1[(s0 >> 16) & 0xFF] ^ T2[(s1 >> 8) & 0xFF] ^ T3[s2 & 0xFF] ^ keys[i + 3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        i = 4 * self._nr
+        t0 = ((S_BOX[s0 >> 24] << 24) | (S_BOX[(s1 >> 16) & 0xFF] << 16) |
+              (S_BOX[(s2 >> 8) & 0xFF] << 8) | S_BOX[s3 & 0xFF]) ^ keys[i]
+        t1 = ((S_BOX[s1 >> 24] << 24) | (S_BOX[(s2 >> 16) & 0xFF] << 16) |
+              (S_BOX[(s3 >> 8) & 0xFF] << 8) | S_BOX[s0 & 0xFF]) ^ keys[i + 1]
+        t2 = ((S_BOX[s2 >> 24] << 24) | (S_BOX[(s3 >> 16) & 0xFF] << 16) |
+              (S_BOX[(s0 >> 8) & 0xFF] << 8) | S_BOX[s1 & 0xFF]) ^ keys[i + 2]
+        t3 = ((S_BOX[s3 >> 24] << 24) | (S_BOX[(s0 >> 16) & 0xFF] << 16) |
+              (S_BOX[(s1 >> 8) & 0xFF] << 8) | S_BOX[s2 & 0xFF]) ^ keys[i + 3]
+
+        return list(((t0 << 96) | (t1 << 64) | (t2 << 32) | t3).to_bytes(16, "big"))
+
+    def _t_table_decrypt(self, ciphertext):
+        keys = self._dec_keys
+        block = int.from_bytes(bytes(ciphertext), "big")
+
+        s0 = (block >> 96) ^ keys[0]
+        s1 = ((block >> 64) & 0xFFFFFFFF) ^ keys[1]
+        s2 = ((block >> 32) & 0xFFFFFFFF) ^ keys[2]
+        s3 = (block & 0xFFFFFFFF) ^ keys[3]
+
+        for i in range(4, 4 * self._nr, 4):
+            t0 = TD0[s0 >> 24] ^ TD1[(s3 >> 16) & 0xFF] ^ TD2[(s2 >> 8) & 0xFF] ^ TD3[s1 & 0xFF] ^ keys[i]
+            t1 = TD0[s1 >> 24] ^ TD1[(s0 >> 16) & 0xFF] ^ TD2[(s3 >> 8) & 0xFF] ^ TD3[s2 & 0xFF] ^ keys[i + 1]
+            t2 = TD0[s2 >> 24] ^ TD1[(s1 >> 16) & 0xFF] ^ TD2[(s0 >> 8) & 0xFF] ^ TD3[s3 & 0xFF] ^ keys[i + 2]
+            t3 = TD0[s3 >> 24] ^ TD1[(s2 >> 16) & 0xFF] ^ TD2[(s1 >> 8) & 0xFF] ^ TD3[s0 & 0xFF] ^ keys[i + 3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        i = 4 * self._nr
+        t0 = ((INV_S_BOX[s0 >> 24] << 24) | (INV_S_BOX[(s3 >> 16) & 0xFF] << 16) |
+              (INV_S_BOX[(s2 >> 8) & 0xFF] << 8) | INV_S_BOX[s1 & 0xFF]) ^ keys[i]
+        t1 = ((INV_S_BOX[s1 >> 24] << 24) | (INV_S_BOX[(s0 >> 16) & 0xFF] << 16) |
+              (INV_S_BOX[(s3 >> 8) & 0xFF] << 8) | INV_S_BOX[s2 & 0xFF]) ^ keys[i + 1]
+        t2 = ((INV_S_BOX[s2 >> 24] << 24) | (INV_S_BOX[(s1 >> 16) & 0xFF] << 16) |
+              (INV_S_BOX[(s0 >> 8) & 0xFF] << 8) | INV_S_BOX[s3 & 0xFF]) ^ keys[i + 2]
+        t3 = ((INV_S_BOX[s3 >> 24] << 24) | (INV_S_BOX[(s2 >> 16) & 0xFF] << 16) |
+              (INV_S_BOX[(s1 >> 8) & 0xFF] << 8) | INV_S_BOX[s0 & 0xFF]) ^ keys[i + 3]
+
+        return list(((t0 << 96) | (t1 << 64) | (t2 << 32) | t3).to_bytes(16, "big"))
+
     def encrypt(self, plaintext):
+        if self._engine == AES_ENGINE.T_TABLE:
+            return self._t_table_encrypt(plaintext)
+        if self._engine == AES_ENGINE.UNROLLED:
+            return unrolled_cipher(self._nr)[0](plaintext, self._enc_keys)
 
         state = array2state(plaintext, self._nb)
 
-        self._add_round_key(state, self._words[:self._nb])
+        self._add_round_key(state, self._round_words[0])
         for round in range(1, self._nr):
             self._sub_bytes(state)
             self._shift_rows(state)
             self._mix_columns(state)
-            self._add_round_key(state, self._words[round * self._nb: (round + 1) * self._nb])
+            self._add_round_key(state, self._round_words[round])
 
         self._sub_bytes(state)
         self._shift_rows(state)
-        self._add_round_key(state, self._words[self._nr * self._nb: (self._nr + 1) * self._nb])
+        self._add_round_key(state, self._round_words[self._nr])
 
         return state2array(state)
 
     def decrypt(self, ciphertext):
+        if self._engine == AES_ENGINE.T_TABLE:
+            return self._t_table_decrypt(ciphertext)
+        if self._engine == AES_ENGINE.UNROLLED:
+            return unrolled_cipher(self._nr)[1](ciphertext, self._dec_keys)
 
         state = array2state(ciphertext, self._nb)
 
-        self._add_round_key(state, self._words[self._nr * self._nb: (self._nr + 1) * self._nb])
-
-        for round in range(self._nr - 1, 0, -1):
-            self._inv_shift_rows(state)
+        # equivalent inverse cipher, the inner round keys already went through InvMixColumns
+        self._add_round_key(state, self._dec_round_words[0])
+        for round in range(1, self._nr):
             self._inv_sub_bytes(state)
-            self._add_round_key(state, self._words[round * self._nb: (round + 1) * self._nb])
+            self._inv_shift_rows(state)
             self._inv_mix_columns(state)
+            self._add_round_key(state, self._dec_round_words[round])
 
-        self._inv_shift_rows(state)
         self._inv_sub_bytes(state)
-        self._add_round_key(state, self._words[:self._nb])
+        self._inv_shift_rows(state)
+        self._add_round_key(state, self._dec_round_words[self._nr])
 
         return state2array(state)
 
 
+class MultiKeyAES:
+    """AES under many keys at once: the K keys are expanded together and each block selects its key by index"""
+
+    def __init__(self, keys, cipher_type=AES_TYPE.AES_128):
+        self._nk = cipher_type["Nk"]
+        self._nb = cipher_type["Nb"]
+        self._nr = cipher_type["Nr"]
+
+        words = key_expansion_blocks(keys, self._nb, self._nk, self._nr)
+        self._round_keys = words.reshape(len(words), self._nr + 1, 4 * self._nb)
+
+        # equivalent inverse cipher keys, see AES._pack_round_keys
+        self._dec_round_keys = self._round_keys[:, ::-1].copy()
+        inner = self._dec_round_keys[:, 1:-1].reshape(-1, 4 * self._nb)
+        self._dec_round_keys[:, 1:-1] = AES._inv_mix_columns_blocks(inner).reshape(len(words), self._nr - 1, -1)
+
+    def __len__(self):
+        return len(self._round_keys)
+
+    def encrypt_blocks(self, blocks, key_indices=None):
+        """Encrypt an ndarray[N, 16] of blocks, block i under the key key_indices[i] (key i by default)"""
+        keys = self._round_keys if key_indices is None else self._round_keys[np.asarray(key_indices)]
+        state = np.asarray(blocks, dtype=np.uint8).reshape(-1, 16) ^ keys[:, 0]
+
+        for round in range(1, self._nr):
+            state = AES._mix_columns_blocks(S_BOX_ARRAY[state[:, SHIFT_ROWS_INDEX]]) ^ keys[:, round]
+
+        return S_BOX_ARRAY[state[:, SHIFT_ROWS_INDEX]] ^ keys[:, self._nr]
+
+    def decrypt_blocks(self, blocks, key_indices=None):
+        """Decrypt an ndarray[N, 16] of blocks, block i under the key key_indices[i] (key i by default)"""
+        keys = self._dec_round_keys if key_indices is None else self._dec_round_keys[np.asarray(key_indices)]
+        state = np.asarray(blocks, dtype=np.uint8).reshape(-1, 16) ^ keys[:, 0]
+
+        for round in range(1, self._nr):
+            state = AES._inv_mix_columns_blocks(INV_S_BOX_ARRAY[state[:, INV_SHIFT_ROWS_INDEX]]) ^ keys[:, round]
+
+        return INV_S_BOX_ARRAY[state[:, INV_SHIFT_ROWS_INDEX]] ^ keys[:, self._nr]
+
+
+class BitslicedAES:
+    """AES over bit planes: plane j holds bit j of every state byte of every block in one Python int.
+
+    Byte position p of block i is bit p * N + i of each plane, so SubBytes is evaluated as a Boolean
+    circuit (GF(2^8) inversion and the affine map) and ShiftRows / MixColumns become shifts of
+    N-bit segments. No lookup tables depend on the data.
+    """
+
+    # below this batch size the fixed cost of transposing the blocks dominates
+    MIN_BLOCKS = 64
+    # number of batch sizes whose masks and key planes are kept
+    MAX_LAYOUTS = 8
+
+    def __init__(self, key, cipher_type=AES_TYPE.AES_128):
+        self._key = key
+
+        self._nk = cipher_type["Nk"]
+        self._nb = cipher_type["Nb"]
+        self._nr = cipher_type["Nr"]
+
+        self._round_keys = expand_round_keys(bytes(key), self._nb, self._nk, self._nr).round_keys
+        self._layouts = {}
+
+    @staticmethod
+    def _segment_moves(index, count):
+        """Shift/mask pairs that move segment index[p] to segment p"""
+        moves = {}
+        for p, source in enumerate(map(int, index)):
+            shift = (p - source) * count
+            moves[shift] = moves.get(shift, 0) | (((1 << count) - 1) << (source * count))
+
+        return tuple(moves.items())
+
+    @staticmethod
+    def _permute(planes, moves):
+        result = []
+        for plane in planes:
+            moved = 0
+            for shift, mask in moves:
+                moved |= (plane & mask) << shift if shift >= 0 else (plane & mask) >> -shift
+            result.append(moved)
+
+        return result
+
+    def _layout(self, count):
+        # the cache may be cleared by another thread at any point, so the layout is only ever returned from a local
+        layout = self._layouts.get(count)
+        if layout is not None:
+            return layout
+
+        segment = (1 << count) - 1
+        key_planes = []
+        for round_key in self._round_keys:
+            key_planes.append([sum(segment << (p * count) for p in range(16) if (round_key[p] >> j) & 1)
+                               for j in range(8)])
+
+        layout = {
+            "full": (1 << (16 * count)) - 1,
+            "keys": key_planes,
+            "shift_rows": self._segment_moves(SHIFT_ROWS_INDEX, count),
+            "inv_shift_rows": self._segment_moves(INV_SHIFT_ROWS_INDEX, count),
+            "rotate": [self._segment_moves([4 * (p // 4) + (p + k) % 4 for p in range(16)], count)
+                       for k in range(4)],
+        }
+
+        if len(self._layouts) >= self.MAX_LAYOUTS:
+            self._layouts.clear()
+        self._layouts[count] = layout
+
+        return layout
+
+    @staticmethod
+    def _to_planes(blocks):
+        bits = np.unpackbits(np.ascontiguousarray(blocks.T)[:, :, np.newaxis], axis=2, bitorder="little")
+        packed = np.packbits(bits.transpose(2, 0, 1).reshape(8, -1), axis=1, bitorder="little")
+        return [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+    @staticmethod
+    def _from_planes(planes, count):
+        packed = np.frombuffer(b"".join(plane.to_bytes(2 * count, "little") for plane in planes), dtype=np.uint8)
+        bits = np.unpackbits(packed.reshape(8, -1), axis=1, count=16 * count, bitorder="little")
+        blocks = np.packbits(bits.reshape(8, 16, count).transpose(2, 1, 0), axis=2, bitorder="little")
+        return blocks.reshape(count, 16)
+
+    @staticmethod
+    def _gf_reduce(product):
+        # x^8 = x^4 + x^3 + x + 1
+        for k in range(14, 7, -1):
+            product[k - 4] ^= product[k]
+            product[k - 5] ^= product[k]
+            product[k - 7] ^= product[k]
+            product[k - 8] ^= product[k]
+
+        return product[:8]
+
+    @staticmethod
+    def _gf_mul(a, b):
+        product = [0] * 15
+        for i in range(8):
+            for j in range(8):
+                product[i + j] ^= a[i] & b[j]
+
+        return BitslicedAES._gf_reduce(product)
+
+    @staticmethod
+    def _gf_square(a):
+        product = [0] * 15
+        product[0::2] = a
+
+        return BitslicedAES._gf_reduce(product)
+
+    @staticmethod
+    def _gf_inverse(x):
+        # x^254 by an addition chain, maps 0 to 0 as the S-box requires
+        x2 = BitslicedAES._gf_square(x)
+        x3 = BitslicedAES._gf_mul(x2, x)
+        x12 = BitslicedAES._gf_square(BitslicedAES._gf_square(x3))
+        x15 = BitslicedAES._gf_mul(x12, x3)
+        x240 = x15
+        for _ in range(4):
+            x240 = BitslicedAES._gf_square(x240)
+
+        return BitslicedAES._gf_mul(BitslicedAES._gf_mul(x240, x12), x2)
+
+    @staticmethod
+    def _sub_bytes(planes, full):
+        x = BitslicedAES._gf_inverse(planes)
+        return [x[i] ^ x[(i + 4) % 8] ^ x[(i + 5) % 8] ^ x[(i + 6) % 8] ^ x[(i + 7) % 8] ^
+                (full if (0x63 >> i) & 1 else 0) for i in range(8)]
+
+    @staticmethod
+    def _inv_sub_bytes(planes, full):
+        x = [planes[(i + 2) % 8] ^ planes[(i + 5) % 8] ^ planes[(i + 7) % 8] ^
+             (full if (0x05 >> i) & 1 else 0) for i in range(8)]
+        return BitslicedAES._gf_inverse(x)
+
+    @staticmethod
+    def _xtime(a):
+        return [a[7], a[0] ^ a[7], a[1], a[2] ^ a[7], a[3] ^ a[7], a[4], a[5], a[6]]
+
+    @staticmethod
+    def _mix_columns(planes, rotate):
+        rot1 = BitslicedAES._permute(planes, rotate[1])
+        rot2 = BitslicedAES._permute(planes, rotate[2])
+        rot3 = BitslicedAES._permute(planes, rotate[3])
+        doubled = BitslicedAES._xtime([a ^ b for a, b in zip(planes, rot1)])
+
+        return [a ^ b ^ c ^ d ^ a ^ x for a, b, c, d, x in zip(planes, rot1, rot2, rot3, doubled)]
+
+    @staticmethod
+    def _inv_mix_columns(planes, rotate):
+        rot2 = BitslicedAES._permute(planes, rotate[2])
+        u = BitslicedAES._xtime(BitslicedAES._xtime([a ^ b for a, b in zip(planes, rot2)]))
+
+        return BitslicedAES._mix_columns([a ^ b for a, b in zip(planes, u)], rotate)
+
+    @staticmethod
+    def _add_round_key(planes, key):
+        return [a ^ k for a, k in zip(planes, key)]
+
+    def encrypt_blocks(self, blocks):
+        """Encrypt an ndarray[N, 16] of uint8 blocks"""
+        blocks = np.asarray(blocks, dtype=np.uint8).reshape(-1, 16)
+        count = len(blocks)
+        layout = self._layout(count)
+        keys, full = layout["keys"], layout["full"]
+
+        state = self._add_round_key(self._to_planes(blocks), keys[0])
+        for round in range(1, self._nr):
+            state = self._permute(self._sub_bytes(state, full), layout["shift_rows"])
+            state = self._add_round_key(self._mix_columns(state, layout["rotate"]), keys[round])
+
+        state = self._permute(self._sub_bytes(state, full), layout["shift_rows"])
+        state = self._add_round_key(state, keys[self._nr])
+
+        return self._from_planes(state, count)
+
+    def decrypt_blocks(self, blocks):
+        """Decrypt an ndarray[N, 16] of uint8 blocks"""
+        blocks = np.asarray(blocks, dtype=np.uint8).reshape(-1, 16)
+        count = len(blocks)
+        layout = self._layout(count)
+        keys, full = layout["keys"], layout["full"]
+
+        state = self._add_round_key(self._to_planes(blocks), keys[self._nr])
+        for round in range(self._nr - 1, 0, -1):
+            state = self._inv_sub_bytes(self._permute(state, layout["inv_shift_rows"]), full)
+            state = self._inv_mix_columns(self._add_round_key(state, keys[round]), layout["rotate"])
+
+        state = self._inv_sub_bytes(self._permute(state, layout["inv_shift_rows"]), full)
+        state = self._add_round_key(state, keys[0])
+
+        return self._from_planes(state, count)
+
+
 if __name__ == '__main__':
     key = bytearray.fromhex("000102030405060708090a0b0c0d0e0f")
     key = [w_i for w_i in key]
@@ -151,3 +603,51 @@ if __name__ == '__main__':
     re_input = aes_128.decrypt(output)
 
     print("rinput:", to_bytes(re_input, ""))
+
+    print("\n****\n")
+
+    for cipher_type, key_hex, expected in (
+            (AES_TYPE.AES_128, "000102030405060708090a0b0c0d0e0f",
+             "69c4e0d86a7b0430d8cdb78070b4c55a"),
+            (AES_TYPE.AES_192, "000102030405060708090a0b0c0d0e0f1011121314151617",
+             "dda97ca4864cdfe06eaf70a0ec0d7191"),
+            (AES_TYPE.AES_256, "000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f",
+             "8ea2b7ca516745bfeafc49904b496089")):
+        for engine in (AES_ENGINE.T_TABLE, AES_ENGINE.UNROLLED):
+            aes = AES([w_i for w_i in bytearray.fromhex(key_hex)], cipher_type, engine)
+
+            output = aes.encrypt(plain_text)
+            print(engine, "output:", to_bytes(output, ""), to_bytes(output, "") == expected)
+            re_input = aes.decrypt(output)
+            print(engine, "rinput:", to_bytes(re_input, ""), re_input == plain_text)
+
+        blocks = np.array([plain_text] * 4, dtype=np.uint8)
+        output = aes.encrypt_blocks(blocks)
+        print("blocks output:", to_bytes(output[0], ""), all(to_bytes(o, "") == expected for o in output))
+        re_input = aes.decrypt_blocks(output)
+        print("blocks rinput:", to_bytes(re_input[0], ""), np.all(re_input == blocks))
+
+        buffer = bytearray(bytes(plain_text) * 4)
+        aes.encrypt_inplace(memoryview(buffer))
+        print("buffer output:", buffer[:16].hex(), buffer.hex() == expected * 4)
+        re_buffer = bytearray(len(buffer))
+        aes.decrypt_into(bytes(buffer), re_buffer)
+        print("buffer rinput:", re_buffer[:16].hex(), re_buffer == bytearray(bytes(plain_text) * 4))
+
+        bitsliced = BitslicedAES([w_i for w_i in bytearray.fromhex(key_hex)], cipher_type)
+        output = bitsliced.encrypt_blocks(blocks)
+        print("bitsliced output:", to_bytes(output[0], ""), all(to_bytes(o, "") == expected for o in output))
+        re_input = bitsliced.decrypt_blocks(output)
+        print("bitsliced rinput:", to_bytes(re_input[0], ""), np.all(re_input == blocks))
+
+    print("\n****\n")
+
+    keys = np.random.randint(256, size=(100, 16), dtype=np.uint8)
+    key_indices = np.random.randint(len(keys), size=(1000,))
+    blocks = np.random.randint(256, size=(1000, 16), dtype=np.uint8)
+
+    multi_key = MultiKeyAES(keys, AES_TYPE.AES_128)
+    output = multi_key.encrypt_blocks(blocks, key_indices)
+    print("multi-key output:", all(np.all(output[i] == AES(keys[k].tolist()).encrypt_blocks(blocks[i]))
+                                   for i, k in enumerate(key_indices[:50])))
+    print("multi-key rinput:", np.all(multi_key.decrypt_blocks(output, key_indices) == blocks))
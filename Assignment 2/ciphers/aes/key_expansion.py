@@ -1,6 +1,10 @@
+import numpy as np
+
 from aes import S_BOX, R_CON
 from tools import print_state
 
+S_BOX_ARRAY = np.array(S_BOX, dtype=np.uint8)
+
 
 def rot_word(word):
     word.append(word.pop(0))
@@ -32,6 +36,26 @@ def key_expansion(key, nb, nk, nr):
     return words
 
 
+def key_expansion_blocks(keys, nb, nk, nr):
+    """key_expansion for an ndarray[K, 4 * nk] of keys at once, returns ndarray[K, nb * (nr + 1), 4]"""
+    keys = np.asarray(keys, dtype=np.uint8).reshape(-1, nk, 4)
+
+    words = np.empty((len(keys), nb * (nr + 1), 4), dtype=np.uint8)
+    words[:, :nk] = keys
+
+    for i in range(nk, nb * (nr + 1)):
+        temp = words[:, i - 1]
+        if i % nk == 0:
+            temp = S_BOX_ARRAY[temp[:, [1, 2, 3, 0]]]
+            temp[:, 0] ^= R_CON[(i // nk)]
+        elif nk > 6 and i % nk == 4:
+            temp = S_BOX_ARRAY[temp]
+
+        words[:, i] = temp ^ words[:, i - nk]
+
+    return words
+
+
 if __name__ == '__main__':
     # AES-128 4 4 10
     print("AES-128 4 4 10")
@@ -73,3 +97,11 @@ if __name__ == '__main__':
     key = [w_i for w_i in w0 + w1 + w2 + w3 + w4 + w5 + w6 + w7]
     words = key_expansion(key, 4, 8, 14)
     print_state(words)
+
+    # All three key sizes through the batched expansion
+    print("\n****************\n")
+    for nk, nr in ((4, 10), (6, 12), (8, 14)):
+        keys = np.random.randint(256, size=(5, 4 * nk), dtype=np.uint8)
+        batch = key_expansion_blocks(keys, 4, nk, nr)
+        print("AES-{} batched:".format(32 * nk),
+              all(np.all(batch[k] == np.array(key_expansion(keys[k].tolist(), 4, nk, nr))) for k in range(len(keys))))
@@ -0,0 +1,50 @@
+from aes import S_BOX, INV_S_BOX
+from tools import xtime
+
+
+def gf_mul(a, b):
+    """Multiply two bytes in GF(2^8) modulo the AES polynomial"""
+    r = 0
+    while b:
+        if b & 1:
+            r ^= a
+        a = xtime(a)
+        b >>= 1
+    return r
+
+
+def rot_right(word, n):
+    return ((word >> n) | (word << (32 - n))) & 0xFFFFFFFF
+
+
+def build_tables(box, column):
+    """Merge the S-box with one MixColumns column into four rotated 32-bit tables"""
+    t0 = tuple((gf_mul(s, column[0]) << 24) | (gf_mul(s, column[1]) << 16) |
+               (gf_mul(s, column[2]) << 8) | gf_mul(s, column[3]) for s in box)
+
+    return (t0,
+            tuple(rot_right(w, 8) for w in t0),
+            tuple(rot_right(w, 16) for w in t0),
+            tuple(rot_right(w, 24) for w in t0))
+
+
+# SubBytes + MixColumns, the column of the state byte in row 0 is (2, 1, 1, 3)
+T0, T1, T2, T3 = build_tables(S_BOX, (0x02, 0x01, 0x01, 0x03))
+
+# InvSubBytes + InvMixColumns, the column of the state byte in row 0 is (e, 9, d, b)
+TD0, TD1, TD2, TD3 = build_tables(INV_S_BOX, (0x0e, 0x09, 0x0d, 0x0b))
+
+
+# multiplication tables for the InvMixColumns coefficients
+MUL_9, MUL_11, MUL_13, MUL_14 = (tuple(gf_mul(a, c) for a in range(256)) for c in (0x09, 0x0b, 0x0d, 0x0e))
+
+
+def inv_mix_column_word(word):
+    """InvMixColumns of a packed 32-bit column, used to prepare decryption round keys"""
+    return (TD0[S_BOX[word >> 24]] ^ TD1[S_BOX[(word >> 16) & 0xFF]] ^
+            TD2[S_BOX[(word >> 8) & 0xFF]] ^ TD3[S_BOX[word & 0xFF]])
+
+
+if __name__ == '__main__':
+    print("T0:", ["{0:08x}".format(w) for w in T0[:4]])
+    print("TD0:", ["{0:08x}".format(w) for w in TD0[:4]])
@@ -0,0 +1,84 @@
+from functools import lru_cache
+
+from aes import S_BOX, INV_S_BOX
+from aes.t_tables import T0, T1, T2, T3, TD0, TD1, TD2, TD3
+
+
+def _unrolled_source(name, nr, tables, box, direction):
+    """Source of a T-table cipher for Nr rounds with every round, key index and state position written out.
+
+    direction is 1 for encryption (row r of column c comes from column c + r) and -1 for the equivalent
+    inverse cipher (row r of column c comes from column c - r).
+    """
+    key_names = ["k{}".format(i) for i in range(4 * (nr + 1))]
+    lines = [
+        "def {}(block, keys, {}):".format(name, ", ".join("{0}={0}".format(t) for t in tables + (box,))),
+        "    {} = keys".format(", ".join(key_names)),
+        "    block = int.from_bytes(bytes(block), 'big')",
+        "    s0 = (block >> 96) ^ k0",
+        "    s1 = ((block >> 64) & 0xFFFFFFFF) ^ k1",
+        "    s2 = ((block >> 32) & 0xFFFFFFFF) ^ k2",
+        "    s3 = (block & 0xFFFFFFFF) ^ k3",
+    ]
+
+    src, dst = "s", "t"
+    for round in range(1, nr):
+        for col in range(4):
+            rows = [(col + direction * row) % 4 for row in range(4)]
+            lines.append("    {dst}{col} = {t0}[{src}{r0} >> 24] ^ {t1}[({src}{r1} >> 16) & 0xFF] ^ "
+                         "{t2}[({src}{r2} >> 8) & 0xFF] ^ {t3}[{src}{r3} & 0xFF] ^ k{key}"
+                         .format(dst=dst, src=src, col=col, key=4 * round + col,
+                                 t0=tables[0], t1=tables[1], t2=tables[2], t3=tables[3],
+                                 r0=rows[0], r1=rows[1], r2=rows[2], r3=rows[3]))
+        src, dst = dst, src
+
+    for col in range(4):
+        rows = [(col + direction * row) % 4 for row in range(4)]
+        lines.append("    {dst}{col} = (({box}[{src}{r0} >> 24] << 24) | ({box}[({src}{r1} >> 16) & 0xFF] << 16) | "
+                     "({box}[({src}{r2} >> 8) & 0xFF] << 8) | {box}[{src}{r3} & 0xFF]) ^ k{key}"
+                     .format(dst=dst, src=src, col=col, key=4 * nr + col, box=box,
+                             r0=rows[0], r1=rows[1], r2=rows[2], r3=rows[3]))
+
+    lines.append("    return list((({0}0 << 96) | ({0}1 << 64) | ({0}2 << 32) | {0}3).to_bytes(16, 'big'))".format(dst))
+
+    return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=None)
+def unrolled_cipher(nr):
+    """Generate (and cache) straight-line encrypt and decrypt functions for Nr rounds.
+
+    Both take a 16-byte block and the packed round keys (AES._enc_keys / AES._dec_keys).
+    """
+    namespace = {"T0": T0, "T1": T1, "T2": T2, "T3": T3, "S_BOX": S_BOX,
+                 "TD0": TD0, "TD1": TD1, "TD2": TD2, "TD3": TD3, "INV_S_BOX": INV_S_BOX}
+
+    exec(_unrolled_source("encrypt", nr, ("T0", "T1", "T2", "T3"), "S_BOX", 1), namespace)
+    exec(_unrolled_source("decrypt", nr, ("TD0", "TD1", "TD2", "TD3"), "INV_S_BOX", -1), namespace)
+
+    return namespace["encrypt"], namespace["decrypt"]
+
+
+if __name__ == '__main__':
+    from datetime import datetime
+
+    from aes.cipher import AES, AES_TYPE, AES_ENGINE
+
+    block = [w_i for w_i in bytearray.fromhex("00112233445566778899aabbccddeeff")]
+
+    for name, cipher_type in (("AES-128", AES_TYPE.AES_128), ("AES-192", AES_TYPE.AES_192),
+                              ("AES-256", AES_TYPE.AES_256)):
+        key = list(range(4 * cipher_type["Nk"]))
+
+        for engine in (AES_ENGINE.T_TABLE, AES_ENGINE.UNROLLED):
+            aes = AES(key, cipher_type, engine)
+
+            t1 = datetime.now()
+            for _ in range(10000):
+                aes.encrypt(block)
+            t2 = datetime.now()
+            for _ in range(10000):
+                aes.decrypt(block)
+            t3 = datetime.now()
+
+            print("{} {:>8} : encrypt {} decrypt {} (10000 blocks)".format(name, engine, t2 - t1, t3 - t2))
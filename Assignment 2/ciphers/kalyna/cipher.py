@@ -1,5 +1,14 @@
+import mmap
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from kalyna import S_BOXES_ENC, S_BOXES_DEC
 from kalyna.key_expansion import KeyExpand
-from tools import string2bytes, bytes2string
+from kalyna.t_tables import T, TD, SHIFT_SOURCES, INV_SHIFT_SOURCES, MASK_64, inv_mix_column_word
+from tools import string2bytes, bytes2string, buffer2blocks
 
 
 class KALYNA_TYPE:
@@ -34,17 +43,270 @@ class KALYNA_TYPE:
     }
 
 
+T_ARRAY = np.array(T, dtype=np.uint64)
+TD_ARRAY = np.array(TD, dtype=np.uint64)
+# InvMixColumns alone: TD[j] composed with the S-box of row j
+INV_MIX_ARRAY = np.array([[TD[j][S_BOXES_ENC[j % 4][x]] for x in range(256)] for j in range(8)], dtype=np.uint64)
+S_BOXES_DEC_ARRAY = np.array([S_BOXES_DEC[j % 4] for j in range(8)], dtype=np.uint8)
+
+# SHIFT_SOURCES[nb][col][row] as an ndarray[8, nb]: the source columns of every output column, row by row
+SHIFT_SOURCES_ARRAY = {nb: np.array(sources).T for nb, sources in SHIFT_SOURCES.items()}
+INV_SHIFT_SOURCES_ARRAY = {nb: np.array(sources).T for nb, sources in INV_SHIFT_SOURCES.items()}
+COLUMN_SOURCES_ARRAY = {nb: np.tile(np.arange(nb), (8, 1)) for nb in SHIFT_SOURCES}
+
+
+# number of distinct (key, KALYNA_TYPE) schedules kept by expand_round_keys
+KEY_SCHEDULE_CACHE_SIZE = 256
+
+# first word of a serialized schedule, followed by Nb, Nk, Nr and the round keys
+SCHEDULE_MAGIC = int.from_bytes(b"KALYNAKS", "little")
+SCHEDULE_HEADER_WORDS = 4
+
+
+KeySchedule = namedtuple("KeySchedule", ["words", "enc_keys", "dec_keys", "round_keys", "dec_round_keys"])
+
+
+def make_key_schedule(round_keys, dec_round_keys):
+    """Derive every form of the round keys from the ndarray[Nr + 1, Nb] encryption and equivalent inverse
+    cipher round keys, the arrays are used as read-only views (they may live in a mmapped file)
+    """
+    round_keys.setflags(write=False)
+    dec_round_keys.setflags(write=False)
+
+    return KeySchedule(list(round_keys),
+                       tuple(tuple(key) for key in round_keys.tolist()),
+                       tuple(tuple(key) for key in dec_round_keys.tolist()),
+                       round_keys, dec_round_keys)
+
+
+@lru_cache(maxsize=KEY_SCHEDULE_CACHE_SIZE)
+def expand_round_keys(key, nb, nk, nr):
+    """Run KeyExpand once per (key bytes, KALYNA_TYPE)"""
+    words = KeyExpand(nb, nk, nr).expansion(np.frombuffer(key, dtype=np.uint64).copy())
+    enc_keys, dec_keys = Kalyna._pack_round_keys(words)
+
+    return make_key_schedule(np.array(enc_keys, dtype=np.uint64), np.array(dec_keys, dtype=np.uint64))
+
+
+class KALYNA_ENGINE:
+    # KeyExpand rounds over a uint8 state
+    BASIC = "basic"
+    # S-boxes, ShiftRows and MixColumns merged into eight 64-bit lookup tables, state is Nb ints
+    T_TABLE = "t_table"
+
+
+class RoundBuffers(threading.local):
+    """Scratch arrays of the batched T-table rounds for blocks of Nb words.
+
+    The arrays are allocated for the largest batch seen so far and sliced for smaller ones, so the rounds of
+    encrypt_blocks / decrypt_blocks write into the same memory across rounds and calls. Every thread gets its
+    own arrays (__init__ runs again on first use in a thread), so one Kalyna object can serve a thread pool.
+    """
+
+    def __init__(self, nb):
+        self._nb = nb
+        self._capacity = -1
+        self.reserve(0)
+
+    def reserve(self, count):
+        if count > self._capacity:
+            self._capacity = count
+            self.state = np.empty((count, self._nb), dtype=np.uint64)
+            self.next = np.empty((count, self._nb), dtype=np.uint64)
+            self.lookup = np.empty((count, self._nb), dtype=np.uint64)
+            self.index = np.empty((count, self._nb), dtype=np.uint8)
+
+    def get(self, count):
+        self.reserve(count)
+        return self.state[:count], self.next[:count], self.index[:count], self.lookup[:count]
+
+
 class Kalyna:
+    # blocks passed to encrypt_blocks / decrypt_blocks per call by the buffer API
+    BUFFER_CHUNK_BLOCKS = 1 << 14
+    # a block is an ndarray of Nb little-endian uint64 words, block_size bytes in memory order
+    block_dtype = np.uint64
 
-    def __init__(self, key, kalyna_type=KALYNA_TYPE.KALYNA_128_128):
+    def __init__(self, key, kalyna_type=KALYNA_TYPE.KALYNA_128_128, engine=KALYNA_ENGINE.BASIC):
 
         self._key = key
 
         self._nk = kalyna_type["Nk"]
         self._nb = kalyna_type["Nb"]
         self._nr = kalyna_type["Nr"]
+        self._engine = engine
+
+        self._set_schedule(expand_round_keys(np.asarray(key, dtype=np.uint64).tobytes(), self._nb, self._nk, self._nr))
+
+    @property
+    def block_size(self):
+        return 8 * self._nb
+
+    def _set_schedule(self, schedule):
+        self._words = schedule.words
+        self._enc_keys = schedule.enc_keys
+        self._dec_keys = schedule.dec_keys
+        self._round_keys = schedule.round_keys
+        self._dec_round_keys = schedule.dec_round_keys
+        self._buffers = RoundBuffers(self._nb)
+
+    def export_schedule(self):
+        """Serialize the round keys as raw little-endian uint64 words:
+        SCHEDULE_MAGIC, Nb, Nk, Nr, the Nr + 1 encryption round keys, the Nr + 1 decryption round keys
+        """
+        header = np.array([SCHEDULE_MAGIC, self._nb, self._nk, self._nr], dtype="<u8")
+
+        return header.tobytes() + self._round_keys.astype("<u8").tobytes() + self._dec_round_keys.astype("<u8").tobytes()
+
+    def save_schedule(self, path):
+        with open(path, "wb") as file:
+            file.write(self.export_schedule())
+
+    @classmethod
+    def from_schedule(cls, buffer, engine=KALYNA_ENGINE.BASIC, offset=0):
+        """Create a Kalyna object from a schedule written by export_schedule without running the key expansion.
+
+        buffer is anything with the buffer protocol (bytes, mmap, memoryview), the round keys stay a view of it.
+        offset is the byte position of the schedule, so several schedules can share one file.
+        """
+        header = np.frombuffer(buffer, dtype="<u8", count=SCHEDULE_HEADER_WORDS, offset=offset)
+        if header[0] != SCHEDULE_MAGIC:
+            raise ValueError("Not a Kalyna key schedule")
+
+        nb, nk, nr = (int(word) for word in header[1:])
+        keys = np.frombuffer(buffer, dtype="<u8", count=2 * (nr + 1) * nb,
+                             offset=offset + 8 * SCHEDULE_HEADER_WORDS).reshape(2, nr + 1, nb)
+
+        kalyna = cls.__new__(cls)
+        kalyna._key = None
+        kalyna._nb, kalyna._nk, kalyna._nr = nb, nk, nr
+        kalyna._engine = engine
+        kalyna._set_schedule(make_key_schedule(keys[0].astype(np.uint64, copy=False),
+                                               keys[1].astype(np.uint64, copy=False)))
+
+        return kalyna
+
+    @classmethod
+    def load_schedule(cls, path, engine=KALYNA_ENGINE.BASIC, offset=0):
+        """Map a file written by save_schedule (or a concatenation of exported schedules) and load one schedule"""
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls.from_schedule(mapping, engine, offset)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_buffers"]
+        return state
 
-        self._words = KeyExpand(self._nb, self._nk, self._nr).expansion(key)
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buffers = RoundBuffers(self._nb)
+
+    @staticmethod
+    def _pack_round_keys(words):
+        enc_keys = tuple(tuple(word.tolist()) for word in words)
+
+        # equivalent inverse cipher: reversed round order, InvMixColumns applied to inner round keys
+        dec_keys = ((enc_keys[-1],) +
+                    tuple(tuple(inv_mix_column_word(w) for w in word) for word in enc_keys[-2:0:-1]) +
+                    (enc_keys[0],))
+
+        return enc_keys, dec_keys
+
+    @staticmethod
+    def _t_table_round(state, tables, sources):
+        t0, t1, t2, t3, t4, t5, t6, t7 = tables
+        return [t0[state[s0] & 0xFF] ^ t1[(state[s1] >> 8) & 0xFF] ^ t2[(state[s2] >> 16) & 0xFF] ^
+                t3[(state[s3] >> 24) & 0xFF] ^ t4[(state[s4] >> 32) & 0xFF] ^ t5[(state[s5] >> 40) & 0xFF] ^
+                t6[(state[s6] >> 48) & 0xFF] ^ t7[state[s7] >> 56]
+                for s0, s1, s2, s3, s4, s5, s6, s7 in sources]
+
+    @staticmethod
+    def _t_table_round_into(state, tables, sources, out, index, lookup):
+        """One T-table round of ndarray[N, Nb] state into out, index and lookup are scratch arrays of the same shape"""
+        state_bytes = state.view(np.uint8).reshape(len(state), -1, 8)
+
+        np.take(state_bytes[:, :, 0], sources[0], axis=1, out=index, mode="clip")
+        np.take(tables[0], index, out=out, mode="clip")
+        for j in range(1, 8):
+            np.take(state_bytes[:, :, j], sources[j], axis=1, out=index, mode="clip")
+            np.take(tables[j], index, out=lookup, mode="clip")
+            np.bitwise_xor(out, lookup, out=out)
+
+        return out
+
+    def encrypt_blocks(self, blocks, out=None):
+        """Encrypt an ndarray[N, Nb] of uint64 blocks, every round is applied to all N blocks at once.
+
+        The rounds run in the scratch buffers of the instance, the result is written to out when given.
+        """
+        blocks = np.asarray(blocks, dtype=np.uint64).reshape(-1, self._nb)
+        keys = self._round_keys
+        sources = SHIFT_SOURCES_ARRAY[self._nb]
+        state, next, index, lookup = self._buffers.get(len(blocks))
+
+        np.add(blocks, keys[0], out=state)
+        for round in range(1, self._nr):
+            self._t_table_round_into(state, T_ARRAY, sources, next, index, lookup)
+            np.bitwise_xor(next, keys[round], out=next)
+            state, next = next, state
+
+        self._t_table_round_into(state, T_ARRAY, sources, next, index, lookup)
+
+        return np.add(next, keys[self._nr], out=out)
+
+    def decrypt_blocks(self, blocks, out=None):
+        """Decrypt an ndarray[N, Nb] of uint64 blocks, every round is applied to all N blocks at once.
+
+        The rounds run in the scratch buffers of the instance, the result is written to out when given.
+        """
+        blocks = np.asarray(blocks, dtype=np.uint64).reshape(-1, self._nb)
+        keys = self._dec_round_keys
+        sources = INV_SHIFT_SOURCES_ARRAY[self._nb]
+        state, next, index, lookup = self._buffers.get(len(blocks))
+
+        np.subtract(blocks, keys[0], out=next)
+        self._t_table_round_into(next, INV_MIX_ARRAY, COLUMN_SOURCES_ARRAY[self._nb], state, index, lookup)
+        for round in range(1, self._nr):
+            self._t_table_round_into(state, TD_ARRAY, sources, next, index, lookup)
+            np.bitwise_xor(next, keys[round], out=next)
+            state, next = next, state
+
+        state_bytes = state.view(np.uint8).reshape(len(state), -1, 8)
+        next_bytes = next.view(np.uint8).reshape(len(next), -1, 8)
+        for j in range(8):
+            np.take(state_bytes[:, :, j], sources[j], axis=1, out=index, mode="clip")
+            np.take(S_BOXES_DEC_ARRAY[j], index, out=next_bytes[:, :, j], mode="clip")
+
+        return np.subtract(next, keys[self._nr], out=out)
+
+    def _t_table_encrypt(self, plaintext):
+        keys = self._enc_keys
+        sources = SHIFT_SOURCES[self._nb]
+
+        state = [(p + k) & MASK_64 for p, k in zip(np.asarray(plaintext, dtype=np.uint64).tolist(), keys[0])]
+        for round_key in keys[1:-1]:
+            state = [s ^ k for s, k in zip(self._t_table_round(state, T, sources), round_key)]
+
+        state = [(s + k) & MASK_64 for s, k in zip(self._t_table_round(state, T, sources), keys[-1])]
+
+        return np.array(state, dtype=np.uint64)
+
+    def _t_table_decrypt(self, ciphertext):
+        keys = self._dec_keys
+        sources = INV_SHIFT_SOURCES[self._nb]
+
+        state = [(c - k) & MASK_64 for c, k in zip(np.asarray(ciphertext, dtype=np.uint64).tolist(), keys[0])]
+        state = [inv_mix_column_word(s) for s in state]
+        for round_key in keys[1:-1]:
+            state = [s ^ k for s, k in zip(self._t_table_round(state, TD, sources), round_key)]
+
+        state = [sum(S_BOXES_DEC[j % 4][(state[source] >> (8 * j)) & 0xFF] << (8 * j) for j, source in enumerate(column))
+                 for column in sources]
+        state = [(s - k) & MASK_64 for s, k in zip(state, keys[-1])]
+
+        return np.array(state, dtype=np.uint64)
 
     @staticmethod
     def _add_round_key(state, key):
@@ -53,6 +315,9 @@ class Kalyna:
                 word[j] ^= key_word[j]
 
     def encrypt(self, plaintext):
+        if self._engine == KALYNA_ENGINE.T_TABLE:
+            return self._t_table_encrypt(plaintext)
+
         state = plaintext.copy()
 
         KeyExpand.add_round_key_expand(state, self._words[0])
@@ -66,6 +331,9 @@ class Kalyna:
         return state
 
     def decrypt(self, ciphertext):
+        if self._engine == KALYNA_ENGINE.T_TABLE:
+            return self._t_table_decrypt(ciphertext)
+
         state = ciphertext.copy()
 
         KeyExpand.sub_round_key_expand(state, self._words[-1])
@@ -78,6 +346,29 @@ class Kalyna:
 
         return state
 
+    def _process_into(self, process_blocks, src, dst):
+        source = buffer2blocks(src, 8 * self._nb, np.uint64)
+        target = buffer2blocks(dst, 8 * self._nb, np.uint64)
+        assert source.shape == target.shape
+
+        for start in range(0, len(source), self.BUFFER_CHUNK_BLOCKS):
+            end = start + self.BUFFER_CHUNK_BLOCKS
+            process_blocks(source[start:end], out=target[start:end])
+
+    def encrypt_into(self, src, dst):
+        """Encrypt the buffer src (bytes, bytearray, memoryview, mmap, ndarray) into the writable buffer dst"""
+        self._process_into(self.encrypt_blocks, src, dst)
+
+    def decrypt_into(self, src, dst):
+        """Decrypt the buffer src (bytes, bytearray, memoryview, mmap, ndarray) into the writable buffer dst"""
+        self._process_into(self.decrypt_blocks, src, dst)
+
+    def encrypt_inplace(self, buffer):
+        self._process_into(self.encrypt_blocks, buffer, buffer)
+
+    def decrypt_inplace(self, buffer):
+        self._process_into(self.decrypt_blocks, buffer, buffer)
+
 
 if __name__ == '__main__':
     key_test = string2bytes("000102030405060708090A0B0C0D0E0F")
@@ -154,3 +445,42 @@ if __name__ == '__main__':
     re_plaintext = kalyna_512_512.decrypt(ciphertext)
     print(bytes2string(re_plaintext))
     print(re_plaintext == plaintext)
+
+    print("\n****\n")
+
+    kalyna_512_512 = Kalyna(key_test, KALYNA_TYPE.KALYNA_512_512, KALYNA_ENGINE.T_TABLE)
+
+    t_table_ciphertext = kalyna_512_512.encrypt(plaintext)
+    print(bytes2string(t_table_ciphertext), np.all(t_table_ciphertext == ciphertext))
+    re_plaintext = kalyna_512_512.decrypt(t_table_ciphertext)
+    print(bytes2string(re_plaintext))
+    print(re_plaintext == plaintext)
+
+    print("\n****\n")
+
+    buffer = bytearray(plaintext.tobytes() * 3)
+    kalyna_512_512.encrypt_inplace(buffer)
+    print(buffer[:64].hex() == bytes2string(ciphertext), buffer[64:128] == buffer[:64])
+    re_buffer = bytearray(len(buffer))
+    kalyna_512_512.decrypt_into(memoryview(buffer), re_buffer)
+    print(re_buffer == bytearray(plaintext.tobytes() * 3))
+
+    print("\n****\n")
+
+    blocks = np.array([plaintext] * 4, dtype=np.uint64)
+    output = kalyna_512_512.encrypt_blocks(blocks)
+    print(bytes2string(output[0]), np.all(output == ciphertext))
+    print(np.all(kalyna_512_512.decrypt_blocks(output) == blocks))
+
+    print("\n****\n")
+
+    import os
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "kalyna_512_512.schedule")
+    kalyna_512_512.save_schedule(path)
+    loaded = Kalyna.load_schedule(path, KALYNA_ENGINE.T_TABLE)
+    print(os.path.getsize(path), "bytes", np.all(loaded.encrypt(plaintext) == ciphertext))
+    print(np.all(Kalyna.from_schedule(kalyna_128_128.export_schedule()).encrypt(string2bytes(
+        "101112131415161718191A1B1C1D1E1F")) == kalyna_128_128.encrypt(string2bytes("101112131415161718191A1B1C1D1E1F"))))
+    print(expand_round_keys.cache_info())
@@ -1,7 +1,8 @@
 import numpy as np
 
 from kalyna import S_BOXES_ENC, S_BOXES_DEC, MDS_MATRIX, MDS_INV_MATRIX
-from tools import string2bytes, bytes2string, to_type
+from kalyna.t_tables import gf_mul
+from tools import string2bytes, bytes2string
 
 
 def print_key_v2(key, l):
@@ -12,6 +13,30 @@ def print_key_v2(key, l):
 print_key = lambda key, l: "".join(["{0:0{1}x}".format(k_i, l) for k_i in key])
 
 
+def shift_rows_index(nb, direction):
+    """Gather index of ShiftRows (direction 1) or InvShiftRows (direction -1) over the Nb * 8 state bytes,
+    row j is rotated by j // (8 // Nb) columns
+    """
+    return np.array([row + ((col - direction * (row // (8 // nb))) % nb) * 8 for col in range(nb) for row in range(8)],
+                    dtype=np.intp)
+
+
+SHIFT_ROWS_INDEX = {nb: shift_rows_index(nb, 1) for nb in (2, 4, 8)}
+INV_SHIFT_ROWS_INDEX = {nb: shift_rows_index(nb, -1) for nb in (2, 4, 8)}
+
+# S-box of every state byte, byte i of the state uses S-box i % 4
+S_BOXES_ENC_ARRAY = np.array(S_BOXES_ENC, dtype=np.uint8)
+S_BOXES_DEC_ARRAY = np.array(S_BOXES_DEC, dtype=np.uint8)
+BOX_INDEX = np.arange(64) % 4
+
+# MDS_PRODUCTS[i, j, x] = matrix[i][j] * x, MixColumns is then a gather and an XOR reduction per column
+MDS_PRODUCTS = np.array([[[gf_mul(x, c) for x in range(256)] for c in row] for row in MDS_MATRIX], dtype=np.uint8)
+MDS_INV_PRODUCTS = np.array([[[gf_mul(x, c) for x in range(256)] for c in row] for row in MDS_INV_MATRIX],
+                            dtype=np.uint8)
+MDS_ROWS = np.arange(8).reshape(1, 8, 1)
+MDS_COLUMNS = np.arange(8).reshape(1, 1, 8)
+
+
 class KeyExpand:
     int2bytes = lambda num: num
 
@@ -61,15 +86,13 @@ class KeyExpand:
 
     @staticmethod
     def sub_bytes(state):
-        for i, s in enumerate(state):
-            state[i] = S_BOXES_ENC[i % 4][s]
+        state[:] = S_BOXES_ENC_ARRAY[BOX_INDEX[:len(state)], state]
 
         return state
 
     @staticmethod
     def inv_sub_bytes(state):
-        for i, s in enumerate(state):
-            state[i] = S_BOXES_DEC[i % 4][s]
+        state[:] = S_BOXES_DEC_ARRAY[BOX_INDEX[:len(state)], state]
 
         return state
 
@@ -87,76 +110,49 @@ class KeyExpand:
         rotate_bytes = 2 * state_size + 3
         bytes_num = state_size * 8
 
-        bytes = to_type(arr, np.uint8)
-        buffer = np.array([0] * rotate_bytes, dtype=np.uint8)
-
-        buffer[0:rotate_bytes] = bytes[0:rotate_bytes]
-        bytes[0:bytes_num - rotate_bytes] = bytes[rotate_bytes:bytes_num]
-        bytes[bytes_num - rotate_bytes:] = buffer[0: rotate_bytes]
+        bytes = np.ascontiguousarray(arr, dtype=np.uint64).view(np.uint8)
 
-        return to_type(bytes, np.uint64)
+        return np.roll(bytes[:bytes_num], -rotate_bytes).view(np.uint64)
 
     @staticmethod
     def shift_rows(state, nb):
-        nstate = np.array([0] * (len(state)), dtype=np.uint8)
-        shift = -1
-        for row in range(8):
-            if row % (8 // nb) == 0:
-                shift += 1
-            for col in range(nb):
-                nstate[row + ((col + shift) % nb) * 8] = state[row + col * 8]
-
-        return nstate
+        return state[SHIFT_ROWS_INDEX[nb]]
 
     @staticmethod
     def inv_shift_rows(state, nb):
-        nstate = np.array([0] * (len(state)), dtype=np.uint8)
-        shift = -1
-        for row in range(8):
-            if row % (8 // nb) == 0:
-                shift += 1
-            for col in range(nb):
-                nstate[row + col * 8] = state[row + ((col + shift) % nb) * 8]
-
-        return nstate
+        return state[INV_SHIFT_ROWS_INDEX[nb]]
 
     @staticmethod
-    def matrix_multiply(state, matrix, nb):
-        nstate = []
-        for col in range(nb):
-            word = state[col * 8: (col + 1) * 8]
-            for i in range(7, -1, -1):
-                product = np.uint8(0)
-                for j in range(7, -1, -1):
-                    product ^= KeyExpand.multGF2(word[j], matrix[i][j])
-                nstate.insert(col * 8, product)
-        return nstate
+    def matrix_multiply(state, products, nb):
+        words = state.reshape(nb, 1, 8)
+        return np.bitwise_xor.reduce(products[MDS_ROWS, MDS_COLUMNS, words], axis=2).reshape(-1)
 
     @staticmethod
     def mix_columns(state, nb):
-        return KeyExpand.matrix_multiply(state, MDS_MATRIX, nb)
+        return KeyExpand.matrix_multiply(state, MDS_PRODUCTS, nb)
 
     @staticmethod
     def inv_mix_columns(state, nb):
-        return KeyExpand.matrix_multiply(state, MDS_INV_MATRIX, nb)
+        return KeyExpand.matrix_multiply(state, MDS_INV_PRODUCTS, nb)
 
     @staticmethod
     def encipher_round(state, nb):
-        state = to_type(state, np.uint8)
-        state = KeyExpand.sub_bytes(state)
+        # the uint8 view shares the buffer of the uint64 words, the gathers below produce the new state
+        state = np.ascontiguousarray(state, dtype=np.uint64).view(np.uint8)
+        state = S_BOXES_ENC_ARRAY[BOX_INDEX[:8 * nb], state]
         state = KeyExpand.shift_rows(state, nb)
         state = KeyExpand.mix_columns(state, nb)
-        return to_type(state, np.uint64)
+        return state.view(np.uint64)
 
     @staticmethod
     def decipher_round(state, nb):
-        state = to_type(state, np.uint8)
+        state = np.ascontiguousarray(state, dtype=np.uint64).view(np.uint8)
 
         state = KeyExpand.inv_mix_columns(state, nb)
         state = KeyExpand.inv_shift_rows(state, nb)
         state = KeyExpand.inv_sub_bytes(state)
 
-        return to_type(state, np.uint64)
+        return state.view(np.uint64)
 
     def key_expand_kt(self, key):
 
@@ -0,0 +1,51 @@
+from kalyna import S_BOXES_ENC, S_BOXES_DEC, MDS_MATRIX, MDS_INV_MATRIX
+
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def gf_mul(x, y):
+    """Multiply two bytes in GF(2^8) modulo the Kalyna polynomial x^8 + x^4 + x^3 + x^2 + 1"""
+    r = 0
+    for i in range(8):
+        if y & 0x1:
+            r ^= x
+        x <<= 1
+        if x & 0x100:
+            x ^= 0x011d
+        y >>= 1
+    return r
+
+
+def build_tables(boxes, matrix):
+    """Merge the S-box of row j with column j of the MDS matrix into eight 256-entry 64-bit tables"""
+    return tuple(tuple(sum(gf_mul(boxes[j % 4][x], matrix[i][j]) << (8 * i) for i in range(8)) for x in range(256))
+                 for j in range(8))
+
+
+def shift_sources(nb, direction):
+    """Column read by row j of every output column: ShiftRows moves row j by j // (8 // nb) columns"""
+    return tuple(tuple((col - direction * (j // (8 // nb))) % nb for j in range(8)) for col in range(nb))
+
+
+# SubBytes + MixColumns, state byte j of a column is the row j
+T = build_tables(S_BOXES_ENC, MDS_MATRIX)
+
+# InvSubBytes + InvMixColumns
+TD = build_tables(S_BOXES_DEC, MDS_INV_MATRIX)
+
+# ShiftRows / InvShiftRows sources for the 2, 4 and 8 column states
+SHIFT_SOURCES = {nb: shift_sources(nb, 1) for nb in (2, 4, 8)}
+INV_SHIFT_SOURCES = {nb: shift_sources(nb, -1) for nb in (2, 4, 8)}
+
+
+def inv_mix_column_word(word):
+    """InvMixColumns of a 64-bit column, used to prepare decryption round keys"""
+    return (TD[0][S_BOXES_ENC[0][word & 0xFF]] ^ TD[1][S_BOXES_ENC[1][(word >> 8) & 0xFF]] ^
+            TD[2][S_BOXES_ENC[2][(word >> 16) & 0xFF]] ^ TD[3][S_BOXES_ENC[3][(word >> 24) & 0xFF]] ^
+            TD[4][S_BOXES_ENC[0][(word >> 32) & 0xFF]] ^ TD[5][S_BOXES_ENC[1][(word >> 40) & 0xFF]] ^
+            TD[6][S_BOXES_ENC[2][(word >> 48) & 0xFF]] ^ TD[7][S_BOXES_ENC[3][word >> 56]])
+
+
+if __name__ == '__main__':
+    print("T0:", ["{0:016x}".format(w) for w in T[0][:4]])
+    print("TD0:", ["{0:016x}".format(w) for w in TD[0][:4]])
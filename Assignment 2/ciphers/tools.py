@@ -17,6 +17,13 @@ def bytes2string(bytes_array):
     return "".join(["{0:0{1}x}".format(num, 2) for num in bytearray(bytes_array)])
 
 
+def buffer2blocks(buffer, block_size, dtype=np.uint8):
+    """Zero-copy ndarray[N, block_size // itemsize] view of an object supporting the buffer protocol"""
+    bytes_array = np.frombuffer(buffer, dtype=np.uint8)
+    assert len(bytes_array) % block_size == 0
+    return bytes_array.view(dtype).reshape(-1, block_size // np.dtype(dtype).itemsize)
+
+
 def to_type(num_array, dtype):
     bytes_array = bytearray(num_array)
     return np.frombuffer(bytes_array, dtype=dtype)
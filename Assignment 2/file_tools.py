@@ -0,0 +1,135 @@
+import mmap
+import os
+
+import numpy as np
+
+from modes.kernel import open_destination
+
+# bytes of the source file processed at a time, rounded down to whole blocks
+CHUNK_SIZE = 1 << 20
+
+
+def _map(file, length, access=mmap.ACCESS_WRITE):
+    if not length:
+        return None, np.empty(0, dtype=np.uint8)
+
+    mapped = mmap.mmap(file.fileno(), length, access=access)
+    return mapped, np.frombuffer(mapped, dtype=np.uint8)
+
+
+def _crypt_file(src_path, dst_path, stream, n, chunk_size, dst_length):
+    """Feed src_path to a ModeStream chunk by chunk, the output goes straight into the mapped dst_path
+    (src_path itself when dst_path is None). Returns the number of bytes written, the file is truncated to it.
+    """
+    length = os.path.getsize(src_path)
+    chunk_size = max(n, chunk_size // n * n)
+    dst_path, in_place = open_destination(src_path, dst_path, dst_length)
+
+    with open(dst_path, "r+b") as dst_file:
+        if in_place:
+            # room for the padding block, the mapping must not be shorter than the source
+            dst_file.truncate(max(dst_length, length))
+        dst, target = _map(dst_file, os.path.getsize(dst_path))
+        src, written = None, 0
+
+        try:
+            if in_place:
+                src, source = dst, target[:length]
+            else:
+                with open(src_path, "rb") as src_file:
+                    src, source = _map(src_file, length, access=mmap.ACCESS_READ)
+
+            for start in range(0, length, chunk_size):
+                # output never gets ahead of the input, so in-place writes only touch bytes already read
+                written += stream.update_into(source[start: start + chunk_size], target[written:])
+
+            tail = stream.finalize()
+            target[written: written + len(tail)] = tail
+            written += len(tail)
+        finally:
+            # the views have to go before the mappings can be closed, also when finalize rejects the padding
+            source = target = None
+            if src is not None and src is not dst:
+                src.close()
+            if dst is not None:
+                dst.flush()
+                dst.close()
+
+            dst_file.truncate(written)
+
+    return written
+
+
+def _mode(cipher, mode):
+    return mode(cipher) if isinstance(mode, type) else mode
+
+
+def encrypt_file(src, dst, cipher, mode, chunk_size=CHUNK_SIZE):
+    """Encrypt the file src into dst (in place when dst is None) through mmap with a working set of about one
+    chunk: every chunk of chunk_size bytes goes through the batched path of the mode, the chaining state is
+    carried between chunks and only the final partial block is padded (ECB, CBC) or truncated (CFB, OFB, CTR).
+
+    mode is a mode class, created over cipher, or a mode object (its IV is needed to decrypt). Returns the mode.
+    """
+    mode = _mode(cipher, mode)
+    n = mode.block_size
+
+    length = os.path.getsize(src)
+    dst_length = length + n - length % n if mode.PADDING else length
+    _crypt_file(src, dst, mode.encryptor(), n, chunk_size, dst_length)
+
+    return mode
+
+
+def decrypt_file(src, dst, cipher, mode, chunk_size=CHUNK_SIZE):
+    """Decrypt a file written by encrypt_file with the same mode object, the padding is removed from dst"""
+    mode = _mode(cipher, mode)
+    _crypt_file(src, dst, mode.decryptor(), mode.block_size, chunk_size, os.path.getsize(src))
+
+    return mode
+
+
+if __name__ == '__main__':
+    import tempfile
+    from datetime import datetime
+
+    from ciphers.aes.cipher import AES, AES_TYPE
+    from ciphers.kalyna.cipher import Kalyna, KALYNA_TYPE, KALYNA_ENGINE
+    from modes.cbc import CBCMode
+    from modes.cfb import CFBMode
+    from modes.ctr import CTRMode
+    from modes.ecb import ECBMode
+    from modes.ofb import OFBMode
+
+    np.random.seed(0)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "plain")
+    PLAINTEXT = np.random.randint(256, size=(1 << 16) * 5 + 7, dtype=np.uint8)
+    PLAINTEXT.tofile(path)
+
+    key = [w_i for w_i in bytearray.fromhex("000102030405060708090a0b0c0d0e0f")]
+    for mode_class in (ECBMode, CBCMode, CFBMode, OFBMode, CTRMode):
+        mode = encrypt_file(path, path + ".enc", AES(key, AES_TYPE.AES_128), mode_class, chunk_size=1 << 16)
+
+        ciphertext = np.fromfile(path + ".enc", dtype=np.uint8)
+        whole = len(PLAINTEXT) // 16 * 16
+        same = np.all(ciphertext[:whole] == mode.encrypt(PLAINTEXT[:whole]))
+
+        decrypt_file(path + ".enc", None, None, mode, chunk_size=1000)
+        print(mode_class.__name__, len(ciphertext), same,
+              np.all(np.fromfile(path + ".enc", dtype=np.uint8) == PLAINTEXT))
+
+    # a larger file through Kalyna-256 CTR, nothing but the current chunk is held in arrays
+    PLAINTEXT = np.random.randint(256, size=(1 << 25) + 3, dtype=np.uint8)
+    PLAINTEXT.tofile(path)
+    del PLAINTEXT
+
+    kalyna_key = np.arange(32, dtype=np.uint8).view(np.uint64)
+    kalyna_256 = Kalyna(kalyna_key, KALYNA_TYPE.KALYNA_256_256, engine=KALYNA_ENGINE.T_TABLE)
+
+    t1 = datetime.now()
+    mode = encrypt_file(path, path + ".enc", kalyna_256, CTRMode)
+    t2 = datetime.now()
+    decrypt_file(path + ".enc", path + ".dec", kalyna_256, mode)
+    print("Kalyna-256 CTR", t2 - t1)
+    print(np.all(np.fromfile(path + ".dec", dtype=np.uint8) == np.fromfile(path, dtype=np.uint8)))
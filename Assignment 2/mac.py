@@ -0,0 +1,193 @@
+import hmac
+from abc import abstractmethod
+
+import numpy as np
+
+from modes.base_mode import BaseMode, map_chunks, process_blocks
+from modes.kernel import as_bytes, as_blocks, block_size, encrypt_block, xor_into
+
+# low terms of the irreducible polynomials of GF(2^(8 n)) used to double a block, n bytes per block
+GF_REDUCTION = {8: 0x1B, 16: 0x87, 32: 0x425, 64: 0x125}
+
+
+def double(value, n):
+    """value * x in GF(2^(8 n)), blocks are big-endian integers"""
+    value <<= 1
+    if value >> (8 * n):
+        value ^= (1 << (8 * n)) | GF_REDUCTION[n]
+    return value
+
+
+def halve(value, n):
+    """value * x^-1 in GF(2^(8 n))"""
+    if value & 1:
+        return ((value ^ GF_REDUCTION[n]) >> 1) | (1 << (8 * n - 1))
+    return value >> 1
+
+
+def to_block(value, n):
+    return np.frombuffer(value.to_bytes(n, byteorder='big'), dtype=np.uint8).copy()
+
+
+def pmac_offsets(l_table, first, count):
+    """Offsets of blocks first, ..., first + count - 1 as ndarray[count, n]: offset i is gray(i) * L,
+    the XOR of the L * x^k for the set bits k of the Gray code of i
+    """
+    index = np.arange(first, first + count, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+
+    offsets = np.zeros((count, l_table.shape[1]), dtype=np.uint8)
+    for k in range(int(gray.max()).bit_length() if count else 0):
+        selected = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        offsets[selected] ^= l_table[k]
+
+    return offsets
+
+
+def pmac_sum(cipher, l_table, blocks, first):
+    """XOR of E(block_i ^ offset_i) over an ndarray[N, n] of blocks whose first one has index first"""
+    encrypted = process_blocks(cipher, "encrypt", xor_into(blocks, pmac_offsets(l_table, first, len(blocks))))
+    return np.bitwise_xor.reduce(encrypted, axis=0)
+
+
+class BlockMAC:
+    """Message authentication code over a block cipher (AES, Kalyna), the tag is the first tag_size bytes
+    of the last block (all n bytes by default)
+    """
+
+    def __init__(self, cipher, tag_size=None):
+        self._cipher = cipher
+        self._n = block_size(cipher)
+        self._tag_size = self._n if tag_size is None else tag_size
+        assert 0 < self._tag_size <= self._n and self._n in GF_REDUCTION
+
+        # L = E(0^n), the subkeys of both MACs are derived from it
+        self._l = int.from_bytes(encrypt_block(cipher, np.zeros(self._n, dtype=np.uint8)).tobytes(), byteorder='big')
+
+    @abstractmethod
+    def mac(self, message):
+        """Tag of a bytes-like message as a uint8 ndarray"""
+        pass
+
+    def verify(self, message, tag):
+        return hmac.compare_digest(self.mac(message).tobytes(), bytes(as_bytes(tag)))
+
+
+class CMAC(BlockMAC):
+    """CMAC (NIST SP 800-38B, RFC 4493): CBC-MAC whose last block is masked with K1 (complete) or K2 (padded)"""
+
+    def __init__(self, cipher, tag_size=None):
+        super(CMAC, self).__init__(cipher, tag_size)
+
+        k1 = double(self._l, self._n)
+        self._k1 = to_block(k1, self._n)
+        self._k2 = to_block(double(k1, self._n), self._n)
+
+    def mac(self, message):
+        data = as_bytes(message)
+        full = max(len(data) - 1, 0) // self._n
+
+        last = np.zeros(self._n, dtype=np.uint8)
+        last[:len(data) - full * self._n] = data[full * self._n:]
+        if len(data) and len(data) % self._n == 0:
+            xor_into(last, self._k1, out=last)
+        else:
+            last[len(data) - full * self._n] = 0x80
+            xor_into(last, self._k2, out=last)
+
+        state = np.zeros(self._n, dtype=np.uint8)
+        for block in as_blocks(data[:full * self._n], self._n):
+            state = encrypt_block(self._cipher, xor_into(state, block))
+
+        return encrypt_block(self._cipher, xor_into(state, last))[:self._tag_size]
+
+
+class PMAC(BlockMAC):
+    """PMAC1 (Rogaway): every block but the last is encrypted on its own under a Gray-code offset, so the
+    blocks go through one batched cipher call or are split over the executor (e.g. ProcessPoolExecutor)
+    """
+    PARALLEL_CHUNK_BLOCKS = BaseMode.PARALLEL_CHUNK_BLOCKS
+    # L * x^k for block indices below 2^L_TABLE_SIZE
+    L_TABLE_SIZE = 64
+
+    def __init__(self, cipher, tag_size=None, executor=None):
+        super(PMAC, self).__init__(cipher, tag_size)
+        self._executor = executor
+
+        table = [self._l]
+        for _ in range(self.L_TABLE_SIZE - 1):
+            table.append(double(table[-1], self._n))
+        self._l_table = np.array([to_block(l_k, self._n) for l_k in table])
+        self._l_inverse = to_block(halve(self._l, self._n), self._n)
+
+    def _sum(self, blocks):
+        if self._executor is None or len(blocks) <= self.PARALLEL_CHUNK_BLOCKS:
+            return pmac_sum(self._cipher, self._l_table, blocks, 1)
+
+        # block indices start at 1
+        partial = map_chunks(self._executor, pmac_sum, blocks, self.PARALLEL_CHUNK_BLOCKS, self._cipher,
+                             self._l_table, first=1)
+
+        return np.bitwise_xor.reduce(np.array(partial), axis=0)
+
+    def mac(self, message):
+        data = as_bytes(message)
+        full = max(len(data) - 1, 0) // self._n
+
+        last = np.zeros(self._n, dtype=np.uint8)
+        last[:len(data) - full * self._n] = data[full * self._n:]
+        if len(data) and len(data) % self._n == 0:
+            xor_into(last, self._l_inverse, out=last)
+        else:
+            last[len(data) - full * self._n] = 0x80
+
+        total = self._sum(as_blocks(data[:full * self._n], self._n)) if full else np.zeros(self._n, dtype=np.uint8)
+
+        return encrypt_block(self._cipher, xor_into(total, last))[:self._tag_size]
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ProcessPoolExecutor
+    from datetime import datetime
+
+    from ciphers.aes.cipher import AES, AES_TYPE
+    from ciphers.kalyna.cipher import Kalyna, KALYNA_TYPE, KALYNA_ENGINE
+
+    # RFC 4493 examples 1 - 4
+    key = [w_i for w_i in bytearray.fromhex("2b7e151628aed2a6abf7158809cf4f3c")]
+    MESSAGE = bytes.fromhex("6bc1bee22e409f96e93d7e117393172aae2d8a571e03ac9c9eb76fac45af8e51"
+                            "30c81c46a35ce411e5fbc1191a0a52eff69f2445df4f9b17ad2b417be66c3710")
+    aes_cmac_128 = CMAC(AES(key, AES_TYPE.AES_128))
+    print(aes_cmac_128.mac(b"").tobytes().hex() == "bb1d6929e95937287fa37d129b756746")
+    print(aes_cmac_128.mac(MESSAGE[:16]).tobytes().hex() == "070a16b46b4d4144f79bdd9dd04a287c")
+    print(aes_cmac_128.mac(MESSAGE[:40]).tobytes().hex() == "dfa66747de9ae63030ca32611497c827")
+    print(aes_cmac_128.mac(MESSAGE).tobytes().hex() == "51f0bebf7e3b9d92fc49741779363cfe")
+
+    # PMAC-AES-128 reference vectors, key 000102...0f and messages 000102...
+    key = [w_i for w_i in bytearray.fromhex("000102030405060708090a0b0c0d0e0f")]
+    aes_pmac_128 = PMAC(AES(key, AES_TYPE.AES_128))
+    print(aes_pmac_128.mac(b"").tobytes().hex() == "4399572cd6ea5341b8d35876a7098af7")
+    print(aes_pmac_128.mac(bytes(range(3))).tobytes().hex() == "256ba5193c1b991b4df0c51f388a9e27")
+    print(aes_pmac_128.mac(bytes(range(16))).tobytes().hex() == "ebbd822fa458daf6dfdad7c27da76338")
+    print(aes_pmac_128.mac(bytes(range(20))).tobytes().hex() == "0412ca150bbf79058d8c75a58c993f55")
+    print(aes_pmac_128.mac(bytes(range(32))).tobytes().hex() == "e97ac04e9e5e3399ce5355cd7407bc75")
+    print(aes_pmac_128.mac(bytes(range(34))).tobytes().hex() == "5cba7d5eb24f7c86ccc54604e53d5512")
+
+    np.random.seed(0)
+    PAYLOAD = np.random.randint(256, size=(1 << 18) + 5, dtype=np.uint8)
+
+    kalyna_key = np.arange(64, dtype=np.uint8).view(np.uint64)
+    kalyna_pmac = PMAC(Kalyna(kalyna_key, KALYNA_TYPE.KALYNA_512_512, engine=KALYNA_ENGINE.T_TABLE))
+    kalyna_cmac = CMAC(Kalyna(kalyna_key, KALYNA_TYPE.KALYNA_512_512, engine=KALYNA_ENGINE.T_TABLE))
+
+    for name, mac in (("Kalyna-512 CMAC", kalyna_cmac), ("Kalyna-512 PMAC", kalyna_pmac)):
+        t1 = datetime.now()
+        tag = mac.mac(PAYLOAD)
+        t2 = datetime.now()
+        print(name, tag.tobytes().hex()[:16], mac.verify(PAYLOAD, tag), mac.verify(PAYLOAD[1:], tag), t2 - t1)
+
+    with ProcessPoolExecutor() as executor:
+        parallel_pmac = PMAC(Kalyna(kalyna_key, KALYNA_TYPE.KALYNA_512_512, engine=KALYNA_ENGINE.T_TABLE),
+                             executor=executor)
+        parallel_pmac.PARALLEL_CHUNK_BLOCKS = 512
+        print(np.all(parallel_pmac.mac(PAYLOAD) == kalyna_pmac.mac(PAYLOAD)))
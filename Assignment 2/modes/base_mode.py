@@ -1,17 +1,94 @@
 from abc import abstractmethod
+from itertools import repeat
+
 import numpy as np
 
+from modes.kernel import as_blocks, block_size, cipher_block, to_cipher_blocks, from_cipher_blocks
+from modes.stream import ModeStream
+
+
+def process_blocks(cipher, method, blocks):
+    """Apply cipher.encrypt / cipher.decrypt (method) to an ndarray[N, n] of blocks, through the batched
+    encrypt_blocks / decrypt_blocks when the cipher has them. Module level so process pools can pickle it.
+    """
+    n = blocks.shape[1]
+
+    if hasattr(cipher, method + "_blocks"):
+        return from_cipher_blocks(cipher, getattr(cipher, method + "_blocks")(to_cipher_blocks(cipher, blocks)), n)
+
+    return np.array([cipher_block(cipher, method, block) for block in blocks], dtype=np.uint8).reshape(-1, n)
+
+
+def map_chunks(executor, fn, blocks, chunk, *args, first=None):
+    """[fn(*args, blocks[start: start + chunk]) for every chunk] through executor.map, one chunk per call. With first,
+    fn also gets the index of the first block of its chunk, first + start, as the last argument.
+    """
+    starts = range(0, len(blocks), chunk)
+    columns = [repeat(arg) for arg in args] + [[blocks[start: start + chunk] for start in starts]]
+    if first is not None:
+        columns.append([first + start for start in starts])
+
+    return list(executor.map(fn, *columns))
+
+
 class BaseMode:
+    # blocks sent to one worker of the executor
+    PARALLEL_CHUNK_BLOCKS = 1 << 14
+    # PKCS#7 padding of streamed messages, modes without it process the final partial block as is
+    PADDING = False
 
-    def __init__(self, cipher, n=16):
+    def __init__(self, cipher, n=None, executor=None):
+        # n defaults to the block size of the cipher and has to match it when given
+        assert n is None or n == block_size(cipher, n)
 
         self._cipher = cipher
-        self._n = n
+        self._n = block_size(cipher) if n is None else n
+        # optional concurrent.futures executor (e.g. ProcessPoolExecutor) for the block-parallel paths, every mode
+        # with such a path takes it as a constructor argument
+        self._executor = executor
+
+    @property
+    def block_size(self):
+        return self._n
+
+    def _process_blocks(self, method, blocks, executor=None):
+        if executor is None or len(blocks) <= self.PARALLEL_CHUNK_BLOCKS:
+            return process_blocks(self._cipher, method, blocks)
+
+        chunks = map_chunks(executor, process_blocks, blocks, self.PARALLEL_CHUNK_BLOCKS, self._cipher, method)
+        return np.concatenate(chunks)
+
+    def _encrypt_blocks(self, blocks, executor=None):
+        return self._process_blocks("encrypt", blocks, executor)
+
+    def _decrypt_blocks(self, blocks, executor=None):
+        return self._process_blocks("decrypt", blocks, executor)
+
+    def _initial_state(self):
+        """Chaining state before the first block (IV, counter), None for modes without one"""
+        return None
 
     @abstractmethod
-    def encrypt(self, plaintext: np.array):
+    def _encrypt_from(self, blocks, state):
+        """Encrypt ndarray[N, n] blocks starting from the chaining state, returns the blocks and the next state"""
         pass
 
     @abstractmethod
+    def _decrypt_from(self, blocks, state):
+        pass
+
+    def encrypt(self, plaintext: np.array):
+        blocks = as_blocks(plaintext, self._n)
+        return np.asarray(self._encrypt_from(blocks, self._initial_state())[0], dtype=np.uint8).reshape(-1)
+
     def decrypt(self, ciphertext: np.array):
-        pass
\ No newline at end of file
+        blocks = as_blocks(ciphertext, self._n)
+        return np.asarray(self._decrypt_from(blocks, self._initial_state())[0], dtype=np.uint8).reshape(-1)
+
+    def encryptor(self):
+        """Streaming encryption of one message with update(chunk) / finalize()"""
+        return ModeStream(self._encrypt_from, self._initial_state(), self._n, pad=self.PADDING)
+
+    def decryptor(self):
+        """Streaming decryption of one message with update(chunk) / finalize()"""
+        return ModeStream(self._decrypt_from, self._initial_state(), self._n, unpad=self.PADDING)
@@ -1,48 +1,38 @@
 import numpy as np
 from modes.base_mode import BaseMode
+from modes.kernel import encrypt_block, xor_into
 
 
 class CBCMode(BaseMode):
+    PADDING = True
 
-    def __init__(self, cipher, n=16):
-        super(CBCMode, self).__init__(cipher, n=n)
+    def __init__(self, cipher, n=None, executor=None):
+        super(CBCMode, self).__init__(cipher, n=n, executor=executor)
 
         self._iv = np.random.randint(256, size=(self._n,), dtype=np.uint8).tolist()
 
-    @staticmethod
-    def xor_arrays(a, b):
-        for i, b_i in enumerate(b):
-            a[i] = a[i] ^ b_i
+    def _initial_state(self):
+        return self._iv
 
-        return a
+    def _encrypt_from(self, blocks, last):
+        ciphertext = np.empty_like(blocks)
 
-    def encrypt(self, plaintext: np.array):
-        ciphertext = []
-        assert len(plaintext) % self._n == 0
+        last = np.asarray(last, dtype=np.uint8)
+        for i, block in enumerate(blocks):
+            last = ciphertext[i] = encrypt_block(self._cipher, xor_into(block, last, out=ciphertext[i]))
 
-        plaintext_list = [plaintext[i * self._n: (i + 1) * self._n].tolist() for i in range(len(plaintext) // self._n)]
+        return ciphertext, last.tolist()
 
-        last = self._iv
-        for input_subtext in plaintext_list:
-            input_subtext = self.xor_arrays(input_subtext, last)
-            last = self._cipher.encrypt(input_subtext)
-            ciphertext.append(last)
+    def _decrypt_from(self, blocks, last):
+        if not len(blocks):
+            return blocks.copy(), last
 
-        return np.concatenate(ciphertext).astype(np.uint8)
+        # every block only depends on the ciphertext, so all of them are decrypted at once (or split over the executor)
+        previous = np.empty_like(blocks)
+        previous[0] = last
+        previous[1:] = blocks[:-1]
 
-    def decrypt(self, ciphertext):
-        plaintext = []
-        assert len(ciphertext) % self._n == 0
-        ciphertext_list = [ciphertext[i * self._n: (i + 1) * self._n].tolist() for i in range(len(ciphertext) // self._n)]
-
-        next = self._iv
-        for input_subtext in ciphertext_list:
-            plainsubtext = self._cipher.decrypt(input_subtext)
-            plainsubtext = self.xor_arrays(plainsubtext, next)
-            plaintext.append(plainsubtext)
-            next = input_subtext
-
-        return np.concatenate(plaintext).astype(np.uint8)
+        return xor_into(self._decrypt_blocks(blocks, self._executor), previous, out=previous), blocks[-1].tolist()
 
 
 if __name__ == '__main__':
@@ -58,3 +48,11 @@ if __name__ == '__main__':
     re_plaintext = aes_cbc_128.decrypt(ciphertext)
 
     print(np.all(PLAINTEXT == re_plaintext))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor() as executor:
+        aes_cbc_128 = CBCMode(AES(key, AES_TYPE.AES_128), 16, executor)
+        aes_cbc_128.PARALLEL_CHUNK_BLOCKS = 8
+        ciphertext = aes_cbc_128.encrypt(PLAINTEXT)
+        print(np.all(PLAINTEXT == aes_cbc_128.decrypt(ciphertext)))
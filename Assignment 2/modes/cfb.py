@@ -1,49 +1,38 @@
 import numpy as np
 
 from modes.base_mode import BaseMode
+from modes.kernel import encrypt_block, xor_into
 
 
 class CFBMode(BaseMode):
-    def __init__(self, cipher, n=16):
-        super(CFBMode, self).__init__(cipher, n=n)
+    def __init__(self, cipher, n=None, executor=None):
+        super(CFBMode, self).__init__(cipher, n=n, executor=executor)
 
         self._iv = np.random.randint(256, size=(self._n,), dtype=np.uint8).tolist()
 
-    @staticmethod
-    def xor_arrays(a, b):
-        res = []
-        for i, b_i in enumerate(b):
-            res.append(a[i] ^ b_i)
+    def _initial_state(self):
+        return self._iv
 
-        return res
+    def _encrypt_from(self, blocks, current):
+        ciphertext = np.empty_like(blocks)
 
-    def encrypt(self, plaintext: np.array):
-        ciphertext = []
-        assert len(plaintext) % self._n == 0
+        current = np.asarray(current, dtype=np.uint8)
+        for i, block in enumerate(blocks):
+            current = xor_into(block, encrypt_block(self._cipher, current), out=ciphertext[i])
 
-        plaintext_list = [plaintext[i * self._n: (i + 1) * self._n].tolist() for i in range(len(plaintext) // self._n)]
+        return ciphertext, current.tolist()
 
-        current = self._iv
-        for plainsubtext in plaintext_list:
-            ciphersubtext = self.xor_arrays(plainsubtext, self._cipher.encrypt(current))
-            ciphertext.append(ciphersubtext)
-            current = ciphersubtext
+    def _decrypt_from(self, blocks, current):
+        if not len(blocks):
+            return blocks.copy(), current
 
-        return np.concatenate(ciphertext).astype(np.uint8)
+        # the keystream is the encryption of the previous ciphertext block, all known up front
+        previous = np.empty_like(blocks)
+        previous[0] = current
+        previous[1:] = blocks[:-1]
 
-    def decrypt(self, ciphertext):
-        plaintext = []
-        assert len(ciphertext) % self._n == 0
-        ciphertext_list = [ciphertext[i * self._n: (i + 1) * self._n].tolist() for i in
-                           range(len(ciphertext) // self._n)]
-
-        current = self._iv
-        for ciphersubtext in ciphertext_list:
-            re_plainsubtext = self.xor_arrays(ciphersubtext, self._cipher.encrypt(current))
-            plaintext.append(re_plainsubtext)
-            current = ciphersubtext
-
-        return np.concatenate(plaintext).astype(np.uint8)
+        keystream = self._encrypt_blocks(previous, self._executor)
+        return xor_into(blocks, keystream, out=previous), blocks[-1].tolist()
 
 
 if __name__ == '__main__':
@@ -60,3 +49,11 @@ if __name__ == '__main__':
     re_plaintext = aes_cfb_128.decrypt(ciphertext)
 
     print(np.all(PLAINTEXT == re_plaintext))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor() as executor:
+        aes_cfb_128 = CFBMode(AES(key, AES_TYPE.AES_128), 16, executor)
+        aes_cfb_128.PARALLEL_CHUNK_BLOCKS = 8
+        ciphertext = aes_cfb_128.encrypt(PLAINTEXT)
+        print(np.all(PLAINTEXT == aes_cfb_128.decrypt(ciphertext)))
@@ -1,47 +1,56 @@
 import numpy as np
 
 from modes.base_mode import BaseMode
+from modes.kernel import as_bytes, xor_into
 
 
 class CTRMode(BaseMode):
-    def __init__(self, cipher, n=16):
-        super(CTRMode, self).__init__(cipher, n=n)
+    def __init__(self, cipher, n=None, executor=None):
+        super(CTRMode, self).__init__(cipher, n=n, executor=executor)
 
         self._iv = bytes(np.random.randint(256, size=(self._n,), dtype=np.uint8).tolist())
 
-    @staticmethod
-    def xor_arrays(a, b):
-        res = []
-        for i, b_i in enumerate(b):
-            res.append(a[i] ^ b_i)
+    def _counter_blocks(self, count, start=0):
+        """Counter blocks IV + start, ..., IV + start + count - 1, the counter is the whole n-byte block read as a
+        big-endian integer that wraps around, built from the last 64-bit word up with the carries propagated
+        """
+        first = (int.from_bytes(self._iv, byteorder='big') + start) % (1 << (8 * self._n))
+        words = np.frombuffer(first.to_bytes(self._n, byteorder='big'), dtype=">u8").astype(np.uint64)
 
-        return res
+        counters = np.empty((count, self._n // 8), dtype=">u8")
+        carry = np.arange(count, dtype=np.uint64)
+        for i in range(self._n // 8 - 1, -1, -1):
+            value = carry + words[i]
+            counters[:, i] = value
+            carry = (value < words[i]).astype(np.uint64)
 
-    def encrypt(self, plaintext: np.array):
-        ciphertext = []
-        assert len(plaintext) % self._n == 0
+        return counters.view(np.uint8).reshape(count, self._n)
 
-        plaintext_list = [plaintext[i * self._n: (i + 1) * self._n].tolist() for i in range(len(plaintext) // self._n)]
+    def keystream(self, offset, length):
+        """Keystream bytes [offset, offset + length), only the blocks covering the range are encrypted"""
+        first_block, skip = divmod(offset, self._n)
+        count = -(-(skip + length) // self._n)
 
-        for i, plainsubtext in enumerate(plaintext_list):
-            nonce = int(int.from_bytes(self._iv, byteorder='big') + i).to_bytes(16, 'big', signed=False)
-            ciphersubtext = self.xor_arrays(plainsubtext, self._cipher.encrypt([c for c in nonce]))
-            ciphertext.append(ciphersubtext)
+        keystream = self._encrypt_blocks(self._counter_blocks(count, first_block), self._executor)
+        return np.asarray(keystream, dtype=np.uint8).reshape(-1)[skip: skip + length]
 
-        return np.concatenate(ciphertext).astype(np.uint8)
+    def crypt_range(self, data, offset):
+        """Encrypt or decrypt data found at byte offset of a message (random access, no block alignment needed).
 
-    def decrypt(self, ciphertext):
-        plaintext = []
-        assert len(ciphertext) % self._n == 0
-        ciphertext_list = [ciphertext[i * self._n: (i + 1) * self._n].tolist() for i in
-                           range(len(ciphertext) // self._n)]
+        data is an ndarray or any bytes-like object, e.g. a range read from an encrypted blob.
+        """
+        data = as_bytes(data)
+        return xor_into(data, self.keystream(offset, len(data)))
 
-        for i, ciphersubtext in enumerate(ciphertext_list):
-            nonce = int(int.from_bytes(self._iv, byteorder='big') + i).to_bytes(16, 'big', signed=False)
-            re_plainsubtext = self.xor_arrays(ciphersubtext, self._cipher.encrypt([c for c in nonce]))
-            plaintext.append(re_plainsubtext)
+    def _initial_state(self):
+        return 0
 
-        return np.concatenate(plaintext).astype(np.uint8)
+    def _encrypt_from(self, blocks, position):
+        keystream = self._encrypt_blocks(self._counter_blocks(len(blocks), position), self._executor)
+        return xor_into(blocks, keystream, out=keystream), position + len(blocks)
+
+    def _decrypt_from(self, blocks, position):
+        return self._encrypt_from(blocks, position)
 
 
 if __name__ == '__main__':
@@ -60,3 +69,8 @@ if __name__ == '__main__':
     re_plaintext = aes_ctr_128.decrypt(ciphertext)
 
     print(np.all(PLAINTEXT == re_plaintext))
+
+    offset, length = 37, 100
+    print(np.all(aes_ctr_128.crypt_range(ciphertext[offset: offset + length], offset) ==
+                 PLAINTEXT[offset: offset + length]))
+    print(bytes(aes_ctr_128.crypt_range(bytes(ciphertext[5: 9]), 5)) == PLAINTEXT[5: 9].tobytes())
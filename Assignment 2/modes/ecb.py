@@ -3,26 +3,13 @@ from modes.base_mode import BaseMode
 
 
 class ECBMode(BaseMode):
+    PADDING = True
 
-    def encrypt(self, plaintext: np.array):
-        ciphertext = []
-        assert len(plaintext) % self._n == 0
+    def _encrypt_from(self, blocks, state):
+        return self._encrypt_blocks(blocks, self._executor), state
 
-        for i in range(len(plaintext) // self._n):
-            ciphersubtext = np.array(self._cipher.encrypt(plaintext[i * self._n: (i + 1) * self._n].tolist()),
-                                     dtype=np.uint8)
-            ciphertext.append(ciphersubtext)
-
-        return np.concatenate(ciphertext).astype(np.uint8)
-
-    def decrypt(self, ciphertext):
-        plaintext = []
-        assert len(ciphertext) % self._n == 0
-
-        for i in range(len(ciphertext) // self._n):
-            plaintext.append(self._cipher.decrypt(ciphertext[i * self._n: (i + 1) * self._n].tolist()))
-
-        return np.concatenate(plaintext).astype(np.uint8)
+    def _decrypt_from(self, blocks, state):
+        return self._decrypt_blocks(blocks, self._executor), state
 
 
 if __name__ == '__main__':
@@ -0,0 +1,176 @@
+import hmac
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from modes.base_mode import BaseMode
+from modes.kernel import as_bytes, xor_into
+
+# number of distinct hash keys H whose GHASH tables are kept
+GHASH_TABLE_CACHE_SIZE = 256
+
+# x^128 = 1 + x + x^2 + x^7, coefficients of x^0 .. x^127 are stored from the most significant bit down
+GCM_R = 0xE1 << 120
+
+
+def mul_x(v):
+    """Multiply a field element by x"""
+    return (v >> 1) ^ GCM_R if v & 1 else v >> 1
+
+
+def _mul_x8(v):
+    for _ in range(8):
+        v = mul_x(v)
+    return v
+
+
+# reduction of the 8 bits shifted out when an element is multiplied by x^8: v * x^8 = (v >> 8) ^ REDUCE_8[v & 0xFF]
+REDUCE_8 = tuple(_mul_x8(r) for r in range(256))
+
+
+@lru_cache(maxsize=GHASH_TABLE_CACHE_SIZE)
+def ghash_table(h):
+    """Shoup's 8-bit table of the hash key H: entry b is H times the byte b (bit 7 of b is the coefficient of x^0)"""
+    table = [0] * 256
+
+    v = h
+    for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+        table[bit] = v
+        v = mul_x(v)
+
+    for b in range(3, 256):
+        low = b & -b
+        if b != low:
+            table[b] = table[low] ^ table[b ^ low]
+
+    return tuple(table)
+
+
+def ghash(table, data, y=0):
+    """GHASH of data (a multiple of 16 bytes) starting from y, one Horner step per byte of every block"""
+    for start in range(0, len(data), 16):
+        x = y ^ int.from_bytes(data[start: start + 16], byteorder='big')
+
+        y = 0
+        for _ in range(16):
+            y = (y >> 8) ^ REDUCE_8[y & 0xFF] ^ table[x & 0xFF]
+            x >>= 8
+
+    return y
+
+
+def zero_pad(data):
+    return bytes(data) + bytes(-len(data) % 16)
+
+
+class GCMMode(BaseMode):
+    """Galois/Counter mode for ciphers with 16-byte blocks: CTR encryption with 32-bit counter increments
+    from J0 + 1 and a GHASH tag over the associated data and the ciphertext.
+
+    The IV is passed to every encrypt / decrypt call and must never be reused with the same key, new_iv()
+    returns a random 12-byte one. encrypt returns the ciphertext followed by the tag, decrypt checks the tag
+    before returning the plaintext.
+    """
+    IV_SIZE = 12
+    TAG_SIZE = 16
+
+    def __init__(self, cipher, n=None, executor=None):
+        super(GCMMode, self).__init__(cipher, n=n, executor=executor)
+        # GCM is defined for 128-bit blocks (AES, Kalyna-128)
+        assert self._n == 16
+
+        h = self._encrypt_blocks(np.zeros((1, 16), dtype=np.uint8))[0]
+        self._table = ghash_table(int.from_bytes(bytes(np.asarray(h, dtype=np.uint8)), byteorder='big'))
+
+    @classmethod
+    def new_iv(cls):
+        # from the OS, a seeded np.random would repeat IVs between runs
+        return os.urandom(cls.IV_SIZE)
+
+    def _j0(self, iv):
+        if len(iv) == 12:
+            return iv + b"\x00\x00\x00\x01"
+
+        lengths = (8 * len(iv)).to_bytes(16, byteorder='big')
+        return ghash(self._table, zero_pad(iv) + lengths).to_bytes(16, byteorder='big')
+
+    @staticmethod
+    def _counter_blocks(j0, count):
+        """Counter blocks J0 + 1, ..., J0 + count where only the last 32 bits are incremented"""
+        counters = np.tile(np.frombuffer(j0, dtype=np.uint8), (count, 1))
+        low = np.arange(count, dtype=np.uint64) + np.uint64(int.from_bytes(j0[12:], byteorder='big') + 1)
+        counters[:, 12:] = (low & np.uint64(0xFFFFFFFF)).astype(">u4").view(np.uint8).reshape(count, 4)
+
+        return counters
+
+    def _gctr(self, j0, data):
+        keystream = self._encrypt_blocks(self._counter_blocks(j0, -(-len(data) // 16)), self._executor)
+        return xor_into(data, np.asarray(keystream, dtype=np.uint8).reshape(-1)[:len(data)])
+
+    def _tag(self, j0, ciphertext, associated_data):
+        lengths = (8 * len(associated_data)).to_bytes(8, byteorder='big') + (8 * len(ciphertext)).to_bytes(8, 'big')
+        s = ghash(self._table, zero_pad(associated_data) + zero_pad(ciphertext.tobytes()) + lengths)
+
+        mask = np.asarray(self._encrypt_blocks(np.frombuffer(j0, dtype=np.uint8).reshape(1, 16)), dtype=np.uint8)
+
+        return np.frombuffer(s.to_bytes(16, byteorder='big'), dtype=np.uint8) ^ mask.reshape(-1)
+
+    def encrypt(self, iv, plaintext, associated_data=b""):
+        j0 = self._j0(bytes(iv))
+        ciphertext = self._gctr(j0, as_bytes(plaintext))
+
+        return np.concatenate([ciphertext, self._tag(j0, ciphertext, bytes(associated_data))])
+
+    def decrypt(self, iv, ciphertext, associated_data=b""):
+        ciphertext = as_bytes(ciphertext)
+        if len(ciphertext) < self.TAG_SIZE:
+            raise ValueError("GCM ciphertext is shorter than the tag")
+
+        j0 = self._j0(bytes(iv))
+        ciphertext, tag = ciphertext[:-self.TAG_SIZE], ciphertext[-self.TAG_SIZE:]
+        if not hmac.compare_digest(self._tag(j0, ciphertext, bytes(associated_data)).tobytes(), tag.tobytes()):
+            raise ValueError("GCM authentication tag mismatch")
+
+        return self._gctr(j0, ciphertext)
+
+    def encryptor(self):
+        raise TypeError("GCM authenticates whole messages, use encrypt / decrypt")
+
+    def decryptor(self):
+        raise TypeError("GCM authenticates whole messages, use encrypt / decrypt")
+
+
+if __name__ == '__main__':
+    from ciphers.aes.cipher import AES, AES_TYPE
+
+    # test cases 1, 2, 3 and 4 of the GCM specification (McGrew, Viega)
+    aes_gcm_128 = GCMMode(AES([0] * 16, AES_TYPE.AES_128), 16)
+    print(aes_gcm_128.encrypt(bytes(12), b"").tobytes().hex() == "58e2fccefa7e3061367f1d57a4e7455a")
+    print(aes_gcm_128.encrypt(bytes(12), bytes(16)).tobytes().hex() ==
+          "0388dace60b6a392f328c2b971b2fe78" "ab6e47d42cec13bdf53a67b21257bddf")
+
+    key = [w_i for w_i in bytearray.fromhex("feffe9928665731c6d6a8f9467308308")]
+    aes_gcm_128 = GCMMode(AES(key, AES_TYPE.AES_128), 16)
+    IV = bytes.fromhex("cafebabefacedbaddecaf888")
+    PLAINTEXT = bytes.fromhex("d9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72"
+                              "1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b391aafd255")
+    CIPHERTEXT = ("42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e"
+                  "21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091473f5985")
+    AAD = bytes.fromhex("feedfacedeadbeeffeedfacedeadbeefabaddad2")
+
+    print(aes_gcm_128.encrypt(IV, PLAINTEXT).tobytes().hex() == CIPHERTEXT + "4d5c2af327cd64a62cf35abd2ba6fab4")
+    ciphertext = aes_gcm_128.encrypt(IV, PLAINTEXT[:60], AAD)
+    print(ciphertext.tobytes().hex() == CIPHERTEXT[:120] + "5bc94fbc3221a5db94fae95ae7121a47")
+    print(aes_gcm_128.decrypt(IV, ciphertext, AAD).tobytes() == PLAINTEXT[:60])
+
+    # a fresh IV per message, the same plaintext never encrypts to the same ciphertext
+    iv_1, iv_2 = GCMMode.new_iv(), GCMMode.new_iv()
+    ciphertext_1, ciphertext_2 = aes_gcm_128.encrypt(iv_1, PLAINTEXT, AAD), aes_gcm_128.encrypt(iv_2, PLAINTEXT, AAD)
+    print(np.any(ciphertext_1 != ciphertext_2), aes_gcm_128.decrypt(iv_2, ciphertext_2, AAD).tobytes() == PLAINTEXT)
+
+    for iv, bad in ((IV, np.concatenate([ciphertext[:1] ^ 1, ciphertext[1:]])), (IV, ciphertext[:15])):
+        try:
+            aes_gcm_128.decrypt(iv, bad, AAD)
+        except ValueError as error:
+            print(error)
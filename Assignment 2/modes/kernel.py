@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+
+def as_bytes(data):
+    """uint8 view of the raw bytes of a message (ndarray, bytes, bytearray, memoryview, mmap), so an array of
+    Kalyna uint64 words keeps all 8 bytes of every word. Only non-contiguous arrays are copied.
+    """
+    if isinstance(data, np.ndarray):
+        if data.dtype.kind not in "ui":
+            raise TypeError("Messages are integer arrays or bytes-like objects, got %s" % data.dtype)
+        return np.ascontiguousarray(data).view(np.uint8).reshape(-1)
+
+    if isinstance(data, list):
+        return np.array(data, dtype=np.uint8)
+
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def as_blocks(data, n):
+    """ndarray[N, n] view of a message whose length is a multiple of n"""
+    data = as_bytes(data)
+    assert len(data) % n == 0
+
+    return data.reshape(-1, n)
+
+
+def block_size(cipher, default=16):
+    """Bytes per block of the cipher (AES 16, Kalyna 16, 32 or 64)"""
+    return getattr(cipher, "block_size", default)
+
+
+def block_dtype(cipher):
+    """Representation of a block in the cipher API: bytes (AES) or little-endian uint64 words (Kalyna)"""
+    return np.dtype(getattr(cipher, "block_dtype", np.uint8))
+
+
+def to_cipher_blocks(cipher, blocks):
+    """ndarray[N, n] of bytes as the cipher reads them, a view when the layout allows it"""
+    dtype = block_dtype(cipher)
+    if dtype == np.uint8:
+        return blocks
+
+    return np.ascontiguousarray(blocks).view(dtype)
+
+
+def from_cipher_blocks(cipher, blocks, n):
+    """Blocks returned by the cipher as ndarray[N, n] of bytes"""
+    return np.ascontiguousarray(blocks, dtype=block_dtype(cipher)).view(np.uint8).reshape(-1, n)
+
+
+def cipher_block(cipher, method, block):
+    """One block through cipher.encrypt / cipher.decrypt (method) as a uint8 ndarray"""
+    if block_dtype(cipher) == np.uint8:
+        # the byte ciphers take lists of ints
+        return np.asarray(getattr(cipher, method)(block.tolist()), dtype=np.uint8)
+
+    result = getattr(cipher, method)(to_cipher_blocks(cipher, block.reshape(1, -1))[0])
+    return from_cipher_blocks(cipher, result, len(block))[0]
+
+
+def encrypt_block(cipher, block):
+    return cipher_block(cipher, "encrypt", block)
+
+
+def xor_into(a, b, out=None):
+    """a ^ b over whole arrays (blocks, keystream chunks), written into out when given"""
+    return np.bitwise_xor(a, b, out=out)
+
+
+def open_destination(src_path, dst_path, length):
+    """Destination of a file processed through mmap: (src_path, True) when dst_path is None or names the same
+    file as src_path, otherwise (dst_path, False) with dst_path created with length bytes. The check comes before
+    anything is opened for writing, "wb" on the source itself would wipe it.
+    """
+    if dst_path is None or (os.path.exists(dst_path) and os.path.samefile(dst_path, src_path)):
+        return src_path, True
+
+    with open(dst_path, "wb") as dst_file:
+        dst_file.truncate(length)
+    return dst_path, False
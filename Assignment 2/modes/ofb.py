@@ -1,49 +1,174 @@
+import threading
+
 import numpy as np
 
 from modes.base_mode import BaseMode
+from modes.kernel import as_blocks, block_size, encrypt_block, xor_into
+from modes.stream import ModeStream
+
+
+class KeystreamBuffer:
+    """Bounded ring buffer of OFB keystream blocks filled ahead of time by a background thread.
+
+    take(count) returns the next count blocks of the keystream that starts at the IV. Blocks that were ready when
+    they were asked for count as hits, blocks the caller had to wait for count as misses. take raises ValueError
+    once the buffer is closed and re-raises an exception of the cipher in the background thread.
+    """
+    CAPACITY = 1 << 12
+    # blocks generated between two updates of the ring
+    BATCH = 64
+
+    def __init__(self, cipher, iv, n=None, capacity=CAPACITY, batch=BATCH):
+        assert capacity > 0 and batch > 0
+
+        n = block_size(cipher) if n is None else n
+        self._cipher = cipher
+        self._n = n
+        self._capacity = capacity
+        self._batch = min(batch, capacity)
+
+        self._ring = np.empty((capacity, n), dtype=np.uint8)
+        self._head = 0
+        self._ready = 0
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._thread = threading.Thread(target=self._fill, args=(np.asarray(iv, dtype=np.uint8),), daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _fill(self, current):
+        try:
+            self._generate(current)
+        except BaseException as error:
+            # a waiting take() must not block forever, it raises the error instead
+            with self._condition:
+                self._error = error
+                self._condition.notify_all()
+
+    def _generate(self, current):
+        while True:
+            with self._condition:
+                while self._ready == self._capacity and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                tail = (self._head + self._ready) % self._capacity
+                count = min(self._capacity - self._ready, self._batch, self._capacity - tail)
+
+            # only this thread writes the free slots [tail, tail + count), the consumer reads the ready ones
+            for i in range(count):
+                current = self._ring[tail + i] = encrypt_block(self._cipher, current)
+
+            with self._condition:
+                self._ready += count
+                self._condition.notify_all()
+
+    def _pop(self, out, start):
+        count = min(self._ready, len(out) - start, self._capacity - self._head)
+        out[start: start + count] = self._ring[self._head: self._head + count]
+
+        self._head = (self._head + count) % self._capacity
+        self._ready -= count
+        self._condition.notify_all()
+
+        return count
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError("KeystreamBuffer is closed")
+
+    def take(self, count):
+        out = np.empty((count, self._n), dtype=np.uint8)
+
+        with self._condition:
+            if self._closed:
+                raise ValueError("KeystreamBuffer is closed")
+
+            done = self._pop(out, 0)
+            if done < count:
+                done += self._pop(out, done)
+            self.hits += done
+
+            while done < count:
+                # blocks that are still missing will never come from a closed or failed producer
+                self._check()
+                self._condition.wait()
+                taken = self._pop(out, done)
+                self.misses += taken
+                done += taken
+
+        return out
 
 
 class OFBMode(BaseMode):
-    def __init__(self, cipher, n=16):
+    # every keystream block depends on the previous one, so there is nothing to hand to an executor
+    def __init__(self, cipher, n=None):
         super(OFBMode, self).__init__(cipher, n=n)
 
         self._iv = np.random.randint(256, size=(self._n,), dtype=np.uint8).tolist()
 
-    @staticmethod
-    def xor_arrays(a, b):
-        res = []
-        for i, b_i in enumerate(b):
-            res.append(a[i] ^ b_i)
+    def _initial_state(self):
+        return self._iv
 
-        return res
+    def _encrypt_from(self, blocks, current):
+        # the keystream chain is sequential, the XOR is one operation over all blocks
+        keystream = np.empty_like(blocks)
 
-    def encrypt(self, plaintext: np.array):
-        ciphertext = []
-        assert len(plaintext) % self._n == 0
+        current = np.asarray(current, dtype=np.uint8)
+        for i in range(len(blocks)):
+            current = keystream[i] = encrypt_block(self._cipher, current)
 
-        plaintext_list = [plaintext[i * self._n: (i + 1) * self._n].tolist() for i in range(len(plaintext) // self._n)]
+        return xor_into(blocks, keystream, out=keystream), current.tolist()
 
-        current = self._iv
-        for plainsubtext in plaintext_list:
-            current = self._cipher.encrypt(current)
-            ciphersubtext = self.xor_arrays(plainsubtext, current)
-            ciphertext.append(ciphersubtext)
+    def _decrypt_from(self, blocks, current):
+        return self._encrypt_from(blocks, current)
 
-        return np.concatenate(ciphertext).astype(np.uint8)
+    def prefetch(self, capacity=KeystreamBuffer.CAPACITY, batch=KeystreamBuffer.BATCH):
+        """Start computing the keystream from the IV in the background, the buffer is passed to encrypt / decrypt /
+        encryptor / decryptor and every call consumes the next blocks, so messages must be decrypted in the order
+        they were encrypted with a buffer of their own
+        """
+        return KeystreamBuffer(self._cipher, self._iv, self._n, capacity, batch)
+
+    @staticmethod
+    def _xor_keystream(blocks, keystream):
+        ready = keystream.take(len(blocks))
+        return xor_into(blocks, ready, out=ready), keystream
 
-    def decrypt(self, ciphertext):
-        plaintext = []
-        assert len(ciphertext) % self._n == 0
-        ciphertext_list = [ciphertext[i * self._n: (i + 1) * self._n].tolist() for i in
-                           range(len(ciphertext) // self._n)]
+    def encrypt(self, plaintext: np.array, keystream=None):
+        if keystream is None:
+            return super(OFBMode, self).encrypt(plaintext)
 
-        current = self._iv
-        for ciphersubtext in ciphertext_list:
-            current = self._cipher.encrypt(current)
-            re_plainsubtext = self.xor_arrays(ciphersubtext, current)
-            plaintext.append(re_plainsubtext)
+        return self._xor_keystream(as_blocks(plaintext, self._n), keystream)[0].reshape(-1)
 
-        return np.concatenate(plaintext).astype(np.uint8)
+    def decrypt(self, ciphertext: np.array, keystream=None):
+        return self.encrypt(ciphertext, keystream)
+
+    def encryptor(self, keystream=None):
+        if keystream is None:
+            return super(OFBMode, self).encryptor()
+        return ModeStream(self._xor_keystream, keystream, self._n)
+
+    def decryptor(self, keystream=None):
+        return self.encryptor(keystream)
 
 
 if __name__ == '__main__':
@@ -60,3 +185,35 @@ if __name__ == '__main__':
     re_plaintext = aes_ofb_128.decrypt(ciphertext)
 
     print(np.all(PLAINTEXT == re_plaintext))
+
+    import time
+
+    with aes_ofb_128.prefetch(capacity=64) as keystream:
+        time.sleep(0.1)
+        print(np.all(aes_ofb_128.encrypt(PLAINTEXT, keystream) == ciphertext), keystream.hits, keystream.misses)
+
+    with aes_ofb_128.prefetch(capacity=64) as keystream:
+        encryptor = aes_ofb_128.encryptor(keystream)
+        streamed = np.concatenate([encryptor.update(PLAINTEXT[i: i + 100]) for i in range(0, len(PLAINTEXT), 100)] +
+                                  [encryptor.finalize()])
+        print(np.all(streamed == ciphertext), keystream.hits + keystream.misses)
+
+    class FailingCipher:
+        block_size = 16
+
+        def encrypt(self, block):
+            raise RuntimeError("cipher failed")
+
+    # a failure in the producer thread and close() from another thread both end a waiting take
+    with KeystreamBuffer(FailingCipher(), [0] * 16) as keystream:
+        try:
+            keystream.take(1)
+        except RuntimeError as error:
+            print(error)
+
+    slow_keystream = KeystreamBuffer(AES(key, AES_TYPE.AES_128), [0] * 16, capacity=64, batch=64)
+    threading.Timer(0.01, slow_keystream.close).start()
+    try:
+        slow_keystream.take(1 << 20)
+    except ValueError as error:
+        print(error)
@@ -0,0 +1,154 @@
+import numpy as np
+
+from modes.kernel import as_bytes
+
+
+def pkcs7_pad(data, n):
+    pad = n - len(data) % n
+    return np.concatenate([data, np.full(pad, pad, dtype=np.uint8)])
+
+
+def pkcs7_unpad(data, n):
+    pad = int(data[-1]) if len(data) else 0
+    if not 1 <= pad <= n or np.any(data[-pad:] != pad):
+        raise ValueError("Invalid PKCS#7 padding")
+
+    return data[:-pad]
+
+
+class ModeStream:
+    """Incremental encryption or decryption of one message: update(chunk) returns the bytes that are ready,
+    finalize() the rest. Partial blocks are kept until more data arrives, the chaining state of the mode
+    (previous block, keystream block, counter) is carried from one call to the next.
+
+    process(blocks, state) -> (blocks, state) is the chained encryption / decryption of the mode.
+    pad adds PKCS#7 padding in finalize, unpad holds the last block back and removes the padding in finalize,
+    without either the final partial block is processed as a truncated block (CFB, OFB, CTR).
+    """
+
+    def __init__(self, process, state, n, pad=False, unpad=False):
+        self._process_from = process
+        self._state = state
+        self._n = n
+        self._pad = pad
+        self._unpad = unpad
+
+        self._buffer = np.empty(0, dtype=np.uint8)
+        self._finalized = False
+
+    def _process(self, data):
+        if not len(data):
+            return np.empty(0, dtype=np.uint8)
+
+        output, self._state = self._process_from(data.reshape(-1, self._n), self._state)
+        return np.asarray(output, dtype=np.uint8).reshape(-1)
+
+    def _process_into(self, data, out):
+        if len(data):
+            out[:len(data)] = self._process(data)
+        return len(data)
+
+    def update_into(self, chunk, out):
+        """update that writes the ready bytes into out (room for the buffered bytes and the chunk) and returns
+        their number. Whole blocks are processed straight from chunk, only partial blocks are copied.
+        """
+        assert not self._finalized
+
+        data = as_bytes(chunk)
+        written = 0
+
+        if len(self._buffer):
+            take = min(self._n - len(self._buffer), len(data))
+            self._buffer = np.concatenate([self._buffer, data[:take]])
+            data = data[take:]
+
+            # a complete block is processed unless it may be the padding (nothing after it yet)
+            if len(self._buffer) == self._n and (len(data) or not self._unpad):
+                written = self._process_into(self._buffer, out)
+                self._buffer = np.empty(0, dtype=np.uint8)
+
+            if len(self._buffer):
+                return written
+
+        full = len(data) // self._n
+        if self._unpad and full and len(data) % self._n == 0:
+            # the last block may be the padding, it is decrypted in finalize
+            full -= 1
+
+        ready = full * self._n
+        written += self._process_into(data[:ready], out[written:])
+        self._buffer = data[ready:].copy()
+
+        return written
+
+    def update(self, chunk):
+        out = np.empty(len(self._buffer) + len(as_bytes(chunk)), dtype=np.uint8)
+        return out[:self.update_into(chunk, out)]
+
+    def finalize(self):
+        assert not self._finalized
+        self._finalized = True
+
+        data, self._buffer = self._buffer, None
+
+        if self._pad:
+            return self._process(pkcs7_pad(data, self._n))
+
+        if self._unpad:
+            if len(data) != self._n:
+                raise ValueError("Ciphertext length is not a multiple of the block size")
+            return pkcs7_unpad(self._process(data), self._n)
+
+        if not len(data):
+            return data
+
+        block = np.zeros(self._n, dtype=np.uint8)
+        block[:len(data)] = data
+        return self._process(block)[:len(data)]
+
+
+if __name__ == '__main__':
+    from ciphers.aes.cipher import AES, AES_TYPE
+    from ciphers.kalyna.cipher import Kalyna, KALYNA_TYPE
+    from modes.cbc import CBCMode
+    from modes.cfb import CFBMode
+    from modes.ctr import CTRMode
+    from modes.ecb import ECBMode
+    from modes.ofb import OFBMode
+
+    np.random.seed(0)
+    key = [w_i for w_i in bytearray.fromhex("000102030405060708090a0b0c0d0e0f")]
+    PLAINTEXT = np.random.randint(256, size=(16 * 20 + 7,), dtype=np.uint8)
+
+    for mode_class in (ECBMode, CBCMode, CFBMode, OFBMode, CTRMode):
+        mode = mode_class(AES(key, AES_TYPE.AES_128), 16)
+
+        encryptor = mode.encryptor()
+        ciphertext = np.concatenate([encryptor.update(PLAINTEXT[i: i + 37]) for i in range(0, len(PLAINTEXT), 37)] +
+                                    [encryptor.finalize()])
+
+        decryptor = mode.decryptor()
+        re_plaintext = np.concatenate([decryptor.update(ciphertext[i: i + 5].tobytes())
+                                       for i in range(0, len(ciphertext), 5)] + [decryptor.finalize()])
+
+        whole = len(PLAINTEXT) // 16 * 16
+        print(mode_class.__name__, len(ciphertext), np.all(PLAINTEXT == re_plaintext),
+              np.all(mode.encrypt(PLAINTEXT[:whole]) == ciphertext[:whole]))
+
+    # wide blocks, the block size comes from the cipher (Kalyna keys are little-endian 64-bit words)
+    for kalyna_type, key_size in ((KALYNA_TYPE.KALYNA_256_256, 32), (KALYNA_TYPE.KALYNA_512_512, 64)):
+        for mode_class in (ECBMode, CBCMode, CFBMode, OFBMode, CTRMode):
+            mode = mode_class(Kalyna(np.arange(key_size, dtype=np.uint8).view(np.uint64), kalyna_type))
+            n = mode._n
+
+            encryptor = mode.encryptor()
+            ciphertext = np.concatenate([encryptor.update(PLAINTEXT[i: i + 37]) for i in range(0, len(PLAINTEXT), 37)] +
+                                        [encryptor.finalize()])
+
+            decryptor = mode.decryptor()
+            re_plaintext = np.concatenate([decryptor.update(ciphertext[i: i + 5]) for i in range(0, len(ciphertext), 5)] +
+                                          [decryptor.finalize()])
+
+            whole = len(PLAINTEXT) // n * n
+            print(mode_class.__name__, n, len(ciphertext), np.all(PLAINTEXT == re_plaintext),
+                  np.all(mode.decrypt(mode.encrypt(PLAINTEXT[:whole])) == PLAINTEXT[:whole]))
@@ -0,0 +1,178 @@
+import mmap
+import os
+
+import numpy as np
+
+from modes.base_mode import BaseMode, map_chunks, process_blocks
+from modes.kernel import as_blocks, block_size, open_destination
+
+# reduction of the bit shifted out when a tweak is doubled, x^128 = x^7 + x^2 + x + 1
+XTS_R = np.uint64(0x87)
+
+
+def sector_tweaks(tweak_cipher, first_sector, count, blocks_per_sector):
+    """Tweaks of every block of the sectors first_sector, ..., first_sector + count - 1 as
+    ndarray[count, blocks_per_sector, 2] of little-endian (low, high) uint64 words.
+
+    The tweak of block 0 is the encrypted sector number, block j + 1 doubles the tweak of block j in GF(2^128).
+    """
+    numbers = np.zeros((count, 2), dtype="<u8")
+    numbers[:, 0] = np.arange(first_sector, first_sector + count, dtype=np.uint64)
+
+    encrypted = process_blocks(tweak_cipher, "encrypt", numbers.view(np.uint8).reshape(count, 16))
+    encrypted = np.ascontiguousarray(encrypted, dtype=np.uint8).view("<u8").reshape(count, 2)
+
+    tweaks = np.empty((count, blocks_per_sector, 2), dtype="<u8")
+    low, high = encrypted[:, 0], encrypted[:, 1]
+    for j in range(blocks_per_sector):
+        tweaks[:, j, 0] = low
+        tweaks[:, j, 1] = high
+
+        carry = high >> np.uint64(63)
+        high = (high << np.uint64(1)) | (low >> np.uint64(63))
+        low = (low << np.uint64(1)) ^ (carry * XTS_R)
+
+    return tweaks
+
+
+def xts_sectors(cipher, tweak_cipher, method, sectors, first_sector):
+    """XTS encryption / decryption (method) of an ndarray[N, sector_size] of consecutive sectors, all blocks of
+    all sectors go through one batched cipher call
+    """
+    count, size = sectors.shape
+    tweaks = sector_tweaks(tweak_cipher, first_sector, count, size // 16)
+
+    blocks = np.ascontiguousarray(sectors, dtype=np.uint8).view("<u8").reshape(count, -1, 2) ^ tweaks
+    blocks = process_blocks(cipher, method, blocks.view(np.uint8).reshape(-1, 16))
+    blocks = np.ascontiguousarray(blocks, dtype=np.uint8).view("<u8").reshape(count, -1, 2) ^ tweaks
+
+    return blocks.view(np.uint8).reshape(count, size)
+
+
+class XTSMode(BaseMode):
+    """XTS (IEEE 1619) for ciphers with 16-byte blocks: cipher encrypts the data, tweak_cipher (a second,
+    independent key) encrypts the sector numbers. Every sector is encrypted on its own, so any range of sectors
+    can be read or rewritten without the rest of the image.
+    """
+    SECTOR_SIZE = 512
+    # sectors of a file mapped and processed at a time
+    FILE_CHUNK_SECTORS = 1 << 11
+
+    def __init__(self, cipher, tweak_cipher, n=None, sector_size=SECTOR_SIZE, executor=None):
+        super(XTSMode, self).__init__(cipher, n=n, executor=executor)
+
+        # XTS is defined for 128-bit blocks (AES, Kalyna-128), ciphertext stealing is not supported
+        assert self._n == 16 and block_size(tweak_cipher) == 16
+        assert sector_size % self._n == 0
+
+        self._tweak_cipher = tweak_cipher
+        self._sector_size = sector_size
+
+    def _process_sectors(self, method, data, first_sector):
+        sectors = as_blocks(data, self._sector_size)
+        chunk_sectors = max(1, self.PARALLEL_CHUNK_BLOCKS * self._n // self._sector_size)
+
+        if self._executor is None or len(sectors) <= chunk_sectors:
+            return xts_sectors(self._cipher, self._tweak_cipher, method, sectors, first_sector).reshape(-1)
+
+        results = map_chunks(self._executor, xts_sectors, sectors, chunk_sectors, self._cipher, self._tweak_cipher,
+                             method, first=first_sector)
+
+        return np.concatenate(results).reshape(-1)
+
+    def encrypt_sectors(self, data, first_sector=0):
+        """Encrypt whole sectors, data[0] is the first byte of sector first_sector"""
+        return self._process_sectors("encrypt", data, first_sector)
+
+    def decrypt_sectors(self, data, first_sector=0):
+        """Decrypt whole sectors, data[0] is the first byte of sector first_sector"""
+        return self._process_sectors("decrypt", data, first_sector)
+
+    def encrypt(self, plaintext: np.array):
+        return self.encrypt_sectors(plaintext, 0)
+
+    def decrypt(self, ciphertext: np.array):
+        return self.decrypt_sectors(ciphertext, 0)
+
+    def encryptor(self):
+        raise TypeError("XTS works on whole sectors, use encrypt_sectors / encrypt_file")
+
+    def decryptor(self):
+        raise TypeError("XTS works on whole sectors, use decrypt_sectors / decrypt_file")
+
+    def _process_file(self, method, src_path, dst_path, first_sector):
+        length = os.path.getsize(src_path)
+        assert length % self._sector_size == 0
+
+        dst_path, in_place = open_destination(src_path, dst_path, length)
+        if not length:
+            return
+
+        with open(dst_path, "r+b") as dst_file, open(src_path, "rb") as src_file:
+            dst = mmap.mmap(dst_file.fileno(), 0)
+            src = dst if in_place else mmap.mmap(src_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            source = np.frombuffer(src, dtype=np.uint8)
+            target = np.frombuffer(dst, dtype=np.uint8)
+            chunk = self.FILE_CHUNK_SECTORS * self._sector_size
+            for start in range(0, length, chunk):
+                target[start: start + chunk] = self._process_sectors(method, source[start: start + chunk],
+                                                                     first_sector + start // self._sector_size)
+
+            del source, target
+            dst.flush()
+            if src is not dst:
+                src.close()
+            dst.close()
+
+    def encrypt_file(self, src_path, dst_path=None, first_sector=0):
+        """Encrypt a disk image through mmap, in place when dst_path is None"""
+        self._process_file("encrypt", src_path, dst_path, first_sector)
+
+    def decrypt_file(self, src_path, dst_path=None, first_sector=0):
+        """Decrypt a disk image through mmap, in place when dst_path is None"""
+        self._process_file("decrypt", src_path, dst_path, first_sector)
+
+
+if __name__ == '__main__':
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    from ciphers.aes.cipher import AES, AES_TYPE
+
+    # IEEE 1619 vectors 1 and 2, data units of 32 bytes
+    aes_xts_128 = XTSMode(AES([0] * 16, AES_TYPE.AES_128), AES([0] * 16, AES_TYPE.AES_128), 16, sector_size=32)
+    print(aes_xts_128.encrypt(bytes(32)).tobytes().hex() ==
+          "917cf69ebd68b2ec9b9fe9a3eadda692cd43d2f59598ed858c02c2652fbf922e")
+
+    aes_xts_128 = XTSMode(AES([0x11] * 16, AES_TYPE.AES_128), AES([0x22] * 16, AES_TYPE.AES_128), 16, sector_size=32)
+    ciphertext = aes_xts_128.encrypt_sectors(bytes([0x44] * 32), 0x3333333333)
+    print(ciphertext.tobytes().hex() == "c454185e6a16936e39334038acef838bfb186fff7480adc4289382ecd6d394f0")
+    print(aes_xts_128.decrypt_sectors(ciphertext, 0x3333333333).tobytes() == bytes([0x44] * 32))
+
+    np.random.seed(0)
+    key = [w_i for w_i in bytearray.fromhex("000102030405060708090a0b0c0d0e0f")]
+    tweak_key = [w_i for w_i in bytearray.fromhex("0f0e0d0c0b0a09080706050403020100")]
+    IMAGE = np.random.randint(256, size=(512 * 100,), dtype=np.uint8)
+
+    aes_xts_128 = XTSMode(AES(key, AES_TYPE.AES_128), AES(tweak_key, AES_TYPE.AES_128), 16)
+    ciphertext = aes_xts_128.encrypt(IMAGE)
+    print(np.all(aes_xts_128.decrypt_sectors(ciphertext[512 * 42: 512 * 45], 42) == IMAGE[512 * 42: 512 * 45]))
+
+    with ProcessPoolExecutor() as executor:
+        parallel_xts = XTSMode(AES(key, AES_TYPE.AES_128), AES(tweak_key, AES_TYPE.AES_128), 16, executor=executor)
+        parallel_xts.PARALLEL_CHUNK_BLOCKS = 512
+        print(np.all(parallel_xts.encrypt(IMAGE) == ciphertext))
+
+    path = os.path.join(tempfile.mkdtemp(), "image")
+    IMAGE.tofile(path)
+    aes_xts_128.FILE_CHUNK_SECTORS = 16
+    aes_xts_128.encrypt_file(path)
+    print(np.all(np.fromfile(path, dtype=np.uint8) == ciphertext))
+    aes_xts_128.decrypt_file(path, path + ".plain")
+    print(np.all(np.fromfile(path + ".plain", dtype=np.uint8) == IMAGE))
+
+    # the same file under another path is still processed in place
+    IMAGE.tofile(path)
+    aes_xts_128.encrypt_file(path, os.path.join(os.path.dirname(path), ".", "image"))
+    print(np.all(np.fromfile(path, dtype=np.uint8) == ciphertext))
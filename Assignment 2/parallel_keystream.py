@@ -0,0 +1,162 @@
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from modes.kernel import open_destination
+
+# cipher of the worker process, set once by the pool initializer instead of being pickled with every chunk
+_cipher = None
+
+
+def _init_worker(cipher):
+    global _cipher
+    _cipher = cipher
+
+
+def _crypt_view(source, target, offset):
+    target[:] = _cipher.crypt_range(source, offset)
+
+
+def _crypt_shared(src_name, dst_name, start, end, offset):
+    src = shared_memory.SharedMemory(name=src_name)
+    dst = src if dst_name == src_name else shared_memory.SharedMemory(name=dst_name)
+
+    source = np.ndarray((end - start,), dtype=np.uint8, buffer=src.buf, offset=start)
+    target = np.ndarray((end - start,), dtype=np.uint8, buffer=dst.buf, offset=start)
+    _crypt_view(source, target, offset + start)
+
+    # the views must be gone before the blocks can be closed
+    del source, target
+    src.close()
+    dst.close()
+
+
+def _crypt_file(src_path, dst_path, start, end, offset):
+    with open(dst_path, "r+b") as dst_file:
+        dst = mmap.mmap(dst_file.fileno(), 0)
+
+        # crypt_file passes the source path itself as the destination when processing in place
+        if dst_path == src_path:
+            src = dst
+        else:
+            with open(src_path, "rb") as src_file:
+                src = mmap.mmap(src_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        source = np.frombuffer(src, dtype=np.uint8, count=end - start, offset=start)
+        target = np.frombuffer(dst, dtype=np.uint8, count=end - start, offset=start)
+        _crypt_view(source, target, offset + start)
+
+        del source, target
+        src.close()
+        if dst is not src:
+            dst.close()
+
+
+class ParallelKeystream:
+    """Keystream XOR of a CTRMode or Salsa (anything with crypt_range(data, offset)) in worker processes.
+
+    The buffer is split into chunks of chunk_size bytes (counter ranges), every worker maps the source and the
+    destination (shared memory blocks or files) and writes its chunk in place, nothing is pickled back.
+    """
+
+    # default chunk, a multiple of the AES, Kalyna and Salsa block sizes
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, cipher, workers=None, chunk_size=CHUNK_SIZE):
+        assert chunk_size > 0
+
+        self._cipher = cipher
+        self._chunk_size = chunk_size
+        self._executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cipher,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+    def _run(self, task, src, dst, length, offset):
+        futures = [self._executor.submit(task, src, dst, start, min(start + self._chunk_size, length), offset)
+                   for start in range(0, length, self._chunk_size)]
+
+        for future in futures:
+            future.result()
+
+    def crypt_shared(self, src, dst=None, length=None, offset=0):
+        """XOR the keystream into shared_memory.SharedMemory blocks, src is processed in place when dst is None.
+
+        length defaults to the size of src (which the OS may round up), offset is the message position of src[0].
+        """
+        dst = src if dst is None else dst
+        length = src.size if length is None else length
+        assert length <= min(src.size, dst.size)
+
+        self._run(_crypt_shared, src.name, dst.name, length, offset)
+
+    def crypt_file(self, src_path, dst_path=None, offset=0):
+        """XOR the keystream into a file through mmap, src_path is processed in place when dst_path is None"""
+        length = os.path.getsize(src_path)
+
+        dst_path, _ = open_destination(src_path, dst_path, length)
+        if length:
+            self._run(_crypt_file, src_path, dst_path, length, offset)
+
+    def crypt(self, data, offset=0):
+        """Encrypt or decrypt bytes-like data through a temporary shared memory block"""
+        data = np.frombuffer(data, dtype=np.uint8)
+        if not len(data):
+            return data.copy()
+
+        block = shared_memory.SharedMemory(create=True, size=len(data))
+        try:
+            buffer = np.ndarray(data.shape, dtype=np.uint8, buffer=block.buf)
+            buffer[:] = data
+
+            self.crypt_shared(block, length=len(data), offset=offset)
+            result = buffer.copy()
+
+            del buffer
+        finally:
+            block.close()
+            block.unlink()
+
+        return result
+
+
+if __name__ == '__main__':
+    import tempfile
+    from datetime import datetime
+
+    from ciphers.aes.cipher import AES, AES_TYPE
+    from modes.ctr import CTRMode
+    from salsa20 import Salsa
+
+    np.random.seed(0)
+    PLAINTEXT = np.random.randint(256, size=(1 << 20) + 5, dtype=np.uint8)
+
+    aes_ctr_128 = CTRMode(AES(list(range(16)), AES_TYPE.AES_128), 16)
+    salsa20 = Salsa(np.arange(32, dtype=np.uint8))
+
+    for name, cipher in (("AES-128 CTR", aes_ctr_128), ("Salsa20", salsa20)):
+        with ParallelKeystream(cipher, workers=4, chunk_size=1 << 16) as engine:
+            t1 = datetime.now()
+            ciphertext = engine.crypt(PLAINTEXT)
+            t2 = datetime.now()
+
+            print(name, np.all(ciphertext == cipher.crypt_range(PLAINTEXT, 0)),
+                  np.all(engine.crypt(ciphertext[1000:], 1000) == PLAINTEXT[1000:]), t2 - t1)
+
+            path = os.path.join(tempfile.mkdtemp(), "blob")
+            PLAINTEXT.tofile(path)
+            engine.crypt_file(path, path + ".enc")
+            engine.crypt_file(path + ".enc")
+            print(name, np.all(np.fromfile(path + ".enc", dtype=np.uint8) == PLAINTEXT))
+
+            engine.crypt_file(path, os.path.join(os.path.dirname(path), ".", "blob"))
+            print(name, np.all(np.fromfile(path, dtype=np.uint8) == ciphertext))
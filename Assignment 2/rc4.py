@@ -16,18 +16,27 @@ class RC4:
 
         def __init__(self, key):
             self._s_init(key)
+            # PRGA position, kept between calls so a message can be processed in pieces
+            self._i = 0
+            self._j = 0
 
         def apply_key(self, data):
-            res = []
-            i = 0
-            j = 0
-            for item in data:
+            s = self._s.tolist()
+            i, j = self._i, self._j
+
+            keystream = np.empty(len(data), dtype=np.uint8)
+            for k in range(len(data)):
                 i = (i + 1) % 256
-                j = (j + self._s[i]) % 256
-                self._s[i], self._s[j] = self._s[i], self._s[j]
-                res.append(item ^ self._s[(self._s[i] + self._s[j]) % 256])
+                j = (j + s[i]) % 256
+                s[i], s[j] = s[j], s[i]
+                keystream[k] = s[(s[i] + s[j]) % 256]
 
-            return np.array(res, dtype=np.uint8)
+            self._s[:] = s
+            self._i, self._j = i, j
+
+            if not isinstance(data, (list, np.ndarray)):
+                data = np.frombuffer(data, dtype=np.uint8)
+            return np.asarray(data, dtype=np.uint8) ^ keystream
 
     def __init__(self, key):
 
@@ -51,3 +60,8 @@ if __name__ == '__main__':
     ciphertext = rc4.encrypt(PLAINTEXT)
     res = rc4.decrypt(ciphertext)
     print(decode(res))
+
+    # RFC 6229, key 0x0102030405, keystream bytes 0 - 15 and 16 - 31 from two calls
+    rc4 = RC4([1, 2, 3, 4, 5])
+    print(bytes(rc4.encrypt(bytes(16))).hex() == "b2396305f03dc027ccc3524a0a1118a8")
+    print(bytes(rc4.encrypt(bytes(16))).hex() == "6982944f18fc82d589c403a47a0d0919")
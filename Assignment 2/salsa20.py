@@ -8,6 +8,10 @@ def to_type(num_array, dtype):
 
 class Salsa:
     MASK = 0xffffffff
+    # bytes of keystream per block position
+    BLOCK_SIZE = 4 * 16
+    # keystreams of up to this many blocks are computed block by block with Python ints
+    SCALAR_BLOCKS = 12
 
     def __init__(self, key, r=20):
         assert r >= 0
@@ -21,12 +25,19 @@ class Salsa:
         assert len(message) == 4 * 16
 
         message = to_type(np.array(message, dtype=np.uint8), np.uint32).tolist()
+        state = self._block_words(pos)
 
-        b = to_type(np.array([pos], dtype=np.uint64), np.uint32).tolist()
+        out = []
+        for m, s in zip(message, state):
+            out.append(m ^ s)
 
+        return to_type(np.array(out, dtype=np.uint32), np.uint8).tolist()
+
+    def _block_words(self, pos):
+        """The 16 keystream words of one block position with Python ints"""
         state = [0x61707865, self._key[0], self._key[1], self._key[2],
                  self._key[3], 0x3320646e, self._nonce[0], self._nonce[1],
-                 b[0], b[1], 0x79622d32, self._key[4],
+                 pos & self.MASK, pos >> 32, 0x79622d32, self._key[4],
                  self._key[5], self._key[6], self._key[7], 0x6b206574]
 
         for i in range(0, self._r, 2):
@@ -40,11 +51,7 @@ class Salsa:
             self._quarterround(state, 10, 11, 8, 9)
             self._quarterround(state, 15, 12, 13, 14)
 
-        out = []
-        for m, s in zip(message, state):
-            out.append(m ^ s)
-
-        return to_type(np.array(out, dtype=np.uint32), np.uint8).tolist()
+        return state
 
     @staticmethod
     def _quarterround(state, a, b, c, d):
@@ -57,29 +64,69 @@ class Salsa:
     def _rotl32(w, r):
         return ((w << r) & Salsa.MASK) | (w >> (32 - r))
 
-    def encrypt(self, plaintext):
-        assert len(plaintext) % (4 * 16) == 0
+    @staticmethod
+    def _quarterround_blocks(state, a, b, c, d):
+        """_quarterround over rows of an ndarray[16, N] of uint32, uint32 additions wrap like the & MASK"""
+        for x, y, z, r in ((b, a, d, 7), (c, b, a, 9), (d, c, b, 13), (a, d, c, 18)):
+            w = state[y] + state[z]
+            state[x] ^= (w << np.uint32(r)) | (w >> np.uint32(32 - r))
+
+    def keystream_blocks(self, start, count):
+        """Keystream of block positions start, ..., start + count - 1 as ndarray[count, 64], all blocks at once.
+        A few blocks are cheaper one by one than through the ~1600 ufunc calls of the vectorized rounds.
+        """
+        if count <= self.SCALAR_BLOCKS:
+            words = [self._block_words(pos) for pos in range(start, start + count)]
+            return np.array(words, dtype="<u4").reshape(count, 16).view(np.uint8)
+
+        pos = np.arange(start, start + count, dtype=np.uint64)
+
+        state = np.empty((16, count), dtype=np.uint32)
+        state[:] = np.array([0x61707865, self._key[0], self._key[1], self._key[2],
+                             self._key[3], 0x3320646e, self._nonce[0], self._nonce[1],
+                             0, 0, 0x79622d32, self._key[4],
+                             self._key[5], self._key[6], self._key[7], 0x6b206574], dtype=np.uint32).reshape(16, 1)
+        state[8] = pos & np.uint64(self.MASK)
+        state[9] = pos >> np.uint64(32)
 
-        n = len(plaintext) // (4 * 16)
+        for i in range(0, self._r, 2):
+            self._quarterround_blocks(state, 0, 4, 8, 12)
+            self._quarterround_blocks(state, 5, 9, 13, 1)
+            self._quarterround_blocks(state, 10, 14, 2, 6)
+            self._quarterround_blocks(state, 15, 3, 7, 11)
 
-        ciphertext = []
-        for i in range(n):
-            ciphersubtext = self._call_salsa(plaintext[i * (4 * 16): (i + 1) * (4 * 16)], i)
-            ciphertext.append(ciphersubtext)
+            self._quarterround_blocks(state, 0, 1, 2, 3)
+            self._quarterround_blocks(state, 5, 6, 7, 4)
+            self._quarterround_blocks(state, 10, 11, 8, 9)
+            self._quarterround_blocks(state, 15, 12, 13, 14)
 
-        return np.concatenate(ciphertext).astype(np.uint8)
+        return np.ascontiguousarray(state.T, dtype="<u4").view(np.uint8)
 
-    def decrypt(self, ciphertext):
-        assert len(ciphertext) % (8 * 16) == 0
+    def keystream(self, offset, length):
+        """Keystream bytes [offset, offset + length), only the block positions covering the range are computed"""
+        first_block, skip = divmod(offset, self.BLOCK_SIZE)
+        count = -(-(skip + length) // self.BLOCK_SIZE)
 
-        n = len(ciphertext) // (8 * 16)
+        return self.keystream_blocks(first_block, count).reshape(-1)[skip: skip + length]
 
-        plaintext = []
-        for i in range(n):
-            re_plainsubtext = self._call_salsa(ciphertext[i * (4 * 16): (i + 1) * (4 * 16)], i)
-            plaintext.append(re_plainsubtext)
+    def crypt_range(self, data, offset):
+        """Encrypt or decrypt data found at byte offset of a message (random access, no block alignment needed)"""
+        if isinstance(data, np.ndarray):
+            data = np.asarray(data, dtype=np.uint8).reshape(-1)
+        else:
+            data = np.frombuffer(bytes(data) if isinstance(data, list) else data, dtype=np.uint8)
 
-        return np.concatenate(plaintext).astype(np.uint8)
+        return data ^ self.keystream(offset, len(data))
+
+    def encrypt(self, plaintext):
+        assert len(plaintext) % (4 * 16) == 0
+
+        return self.crypt_range(plaintext, 0)
+
+    def decrypt(self, ciphertext):
+        assert len(ciphertext) % (4 * 16) == 0
+
+        return self.crypt_range(ciphertext, 0)
 
 
 if __name__ == '__main__':
@@ -91,3 +138,7 @@ if __name__ == '__main__':
     ciphertext = salsa20.encrypt(PLAINTEXT)
     re_plaintext = salsa20.encrypt(ciphertext)
     print(all([r == p for r, p in zip(re_plaintext, PLAINTEXT)]))
+
+    reference = np.concatenate([salsa20._call_salsa(PLAINTEXT[i * 64: (i + 1) * 64], i) for i in range(10)])
+    print(np.all(reference == ciphertext), np.all(salsa20.decrypt(ciphertext) == PLAINTEXT))
+    print(np.all(salsa20.crypt_range(ciphertext[100: 300], 100) == PLAINTEXT[100: 300]))